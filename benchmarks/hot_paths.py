@@ -0,0 +1,231 @@
+# Hot-path benchmark for ARIA on synthetic calendars and long conversations.
+#
+# Jalankan dari root repository:
+#   python benchmarks/hot_paths.py --sizes 10 1000 10000 100000 --runs 3 --output hot_paths.json
+#
+# main.py diimpor langsung (Streamlit berjalan dalam "bare mode"), jadi yang diukur adalah fungsi aslinya.
+# Hasil JSON bisa dibandingkan antar rilis untuk melihat regresi.
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_ics import generate_ics
+
+# Prompt yang dipakai untuk mengukur pembuatan konteks kalender
+CONTEXT_PROMPTS = [
+    "What's on my schedule tomorrow?",
+    "Kapan saya ada waktu luang minggu depan?",
+    "Do I have any gym sessions this week?",
+    "Help me plan a better routine",
+]
+
+# Aturan berulang yang dimulai jauh di masa lalu: biaya query tidak boleh tumbuh dengan umur aturannya
+OLD_RULES = ["FREQ=DAILY", "FREQ=WEEKLY;BYDAY=MO,WE,FR", "FREQ=DAILY;INTERVAL=2", "FREQ=MONTHLY;BYMONTHDAY=15"]
+OLD_RULES_SINCE = datetime(2010, 1, 1, 8, 0)
+# Aturan yang sangat rapat dari file kecil: jumlah kejadiannya harus dibatasi, bukan diuraikan semuanya
+DENSE_RULES = ["FREQ=SECONDLY", "FREQ=MINUTELY;COUNT=2000000"]
+
+
+def import_main():
+    os.environ.setdefault("DEFAULT_API_KEY", "benchmark")
+    os.environ.setdefault("DEFAULT_MODEL", "gpt-4o-mini")
+    os.environ["DEFAULT_CONVERSATION_DB"] = ""  # Jangan menulis percakapan benchmark ke disk
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+# Function to time `function` over several runs; setup() builds fresh input for every run
+def measure(function, runs, setup=None):
+    timings = []
+    for _ in range(runs):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append(time.perf_counter() - started)
+    return {"median_s": statistics.median(timings), "min_s": min(timings)}
+
+
+# Function to benchmark parsing, indexing, analysis and prompt context for one calendar size
+def calendar_benchmark(main, size, runs):
+    data = generate_ics(size, seed=size)
+
+    def parse(_=None):
+        calendar_manager = main.CalendarManager()
+        # Batas ukuran impor dinaikkan: yang diukur parser-nya, bukan batasnya
+        if not calendar_manager.parse_ics_file(io.BytesIO(data), max_bytes=len(data) + 1, max_events=size + 1):
+            raise RuntimeError(calendar_manager.error)
+        return calendar_manager
+
+    calendar_manager = parse()
+    events = calendar_manager.events
+    now = datetime.now(main.pytz.timezone('Asia/Jakarta'))
+
+    def week(manager):
+        return manager.events_between(now, now + timedelta(days=7))
+
+    chat_manager = main.ConversationManager()
+    for prompt in CONTEXT_PROMPTS:
+        chat_manager.count_tokens(prompt)  # Muat tokenizer di luar pengukuran
+
+    week(calendar_manager)  # Index dan cache kejadian berulang dibangun di luar pengukuran "hangat"
+
+    def calendar_context():
+        calendar_manager._analysis = None  # Ukur juga analisis, bukan hanya cache-nya
+        for prompt in CONTEXT_PROMPTS:
+            chat_manager.update_calendar_context(calendar_manager, prompt)
+
+    return {
+        "ics_bytes": len(data),
+        "events": len(events),
+        "parse_ics_file": measure(parse, runs),
+        "build_index": measure(lambda manager: manager.index, runs, setup=lambda: fresh_manager(main, events)),
+        "analyze_activity_schedule": measure(lambda: main.analyze_activity_schedule(events), runs),
+        # Query pertama membangun index dan cache kejadian berulang; berikutnya memakai keduanya
+        "events_between_week_cold": measure(week, runs, setup=lambda: fresh_manager(main, events)),
+        "events_between_week": measure(lambda: week(calendar_manager), runs),
+        "free_slots_week": measure(lambda: main.find_free_slots(calendar_manager, now.date(), 7, not_before=now.timestamp()), runs),
+        "calendar_context_per_prompt": scale(measure(calendar_context, runs), 1 / len(CONTEXT_PROMPTS)),
+    }
+
+
+# Function to benchmark window queries over recurring events that started in 2010
+def recurring_benchmark(main, rules, runs):
+    zone = main.pytz.timezone('Asia/Jakarta')
+    events = []
+    for number in range(rules):
+        start = zone.localize(OLD_RULES_SINCE + timedelta(minutes=15 * (number % 40)))
+        events.append({
+            "summary": f"Routine {number}", "start": start, "end": start + timedelta(minutes=30),
+            "rrule": OLD_RULES[number % len(OLD_RULES)], "uid": f"routine-{number}@aria.example",
+        })
+    now = datetime.now(zone)
+    calendar_manager = fresh_manager(main, events)
+    calendar_manager.events_between(now, now + timedelta(days=1))
+    next_year = now + timedelta(days=365)
+
+    return {
+        "rules": rules,
+        "since": OLD_RULES_SINCE.date().isoformat(),
+        "events_between_day_cold": measure(lambda manager: manager.events_between(now, now + timedelta(days=1)), runs, setup=lambda: fresh_manager(main, events)),
+        "events_between_week": measure(lambda: calendar_manager.events_between(now, now + timedelta(days=7)), runs),
+        "events_between_week_next_year": measure(lambda: calendar_manager.events_between(next_year, next_year + timedelta(days=7)), runs),
+    }
+
+
+# Function to benchmark a calendar of a few very dense rules: the first day query and the schedule analysis
+def dense_benchmark(main, runs):
+    zone = main.pytz.timezone('Asia/Jakarta')
+    now = datetime.now(zone)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=30)
+    events = [
+        {"summary": f"Dense {number}", "start": start, "end": start + timedelta(seconds=1), "rrule": rule, "uid": f"dense-{number}@aria.example"}
+        for number, rule in enumerate(DENSE_RULES)
+    ]
+
+    def day_and_analysis(manager):
+        manager.events_between(now, now + timedelta(days=1))
+        manager.analysis()
+
+    return {
+        "rules": DENSE_RULES,
+        "events_between_day_and_analysis_cold": measure(day_and_analysis, runs, setup=lambda: fresh_manager(main, events)),
+    }
+
+
+def fresh_manager(main, events):
+    calendar_manager = main.CalendarManager()
+    calendar_manager.load_events(events)
+    return calendar_manager
+
+
+def scale(result, factor):
+    return {key: value * factor for key, value in result.items()}
+
+
+# Function to benchmark token counting and budget enforcement over a long conversation
+def conversation_benchmark(main, messages, runs):
+    contents = [
+        f"Message {number}: " + "please move my gym session and check the meeting notes " * (1 + number % 20)
+        for number in range(messages)
+    ]
+
+    chat_manager = main.ConversationManager()
+    chat_manager.count_tokens("warm up")
+
+    def count_all():
+        for content in contents:
+            chat_manager.count_tokens(content)
+
+    def fill_with_budget(manager):
+        for number, content in enumerate(contents):
+            manager.conversation_history.append({"role": "user" if number % 2 == 0 else "assistant", "content": content})
+            manager.enforce_token_budget()
+
+    return {
+        "messages": messages,
+        "count_tokens_per_message": scale(measure(count_all, runs), 1 / messages),
+        "append_and_enforce_budget_per_turn": scale(measure(fill_with_budget, runs, setup=main.ConversationManager), 1 / messages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ARIA hot paths on synthetic calendars.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000, 100000], help="calendar sizes in events")
+    parser.add_argument("--messages", type=int, nargs="+", default=[100, 2000], help="conversation lengths in messages")
+    parser.add_argument("--recurring-rules", type=int, default=500, help="recurring events starting in 2010")
+    parser.add_argument("--max-query-seconds", type=float, default=0.5, help="fail when a warm week-long query takes longer")
+    parser.add_argument("--max-cold-query-seconds", type=float, default=5.0, help="fail when the first week-long query on a new calendar takes longer")
+    parser.add_argument("--runs", type=int, default=3, help="runs per measurement")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    aria = import_main()
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "runs": args.runs,
+        "calendar": {},
+        "conversation": {},
+    }
+    report["recurring"] = recurring_benchmark(aria, args.recurring_rules, args.runs)
+    report["dense"] = dense_benchmark(aria, args.runs)
+    for size in args.sizes:
+        report["calendar"][str(size)] = calendar_benchmark(aria, size, args.runs)
+        print(f"calendar {size}: parse {report['calendar'][str(size)]['parse_ics_file']['median_s']:.3f}s", file=sys.stderr)
+    for messages in args.messages:
+        report["conversation"][str(messages)] = conversation_benchmark(aria, messages, args.runs)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+    # Regresi pada query jendela membuat benchmark gagal, bukan hanya tercatat di laporan
+    budgets = [(f"recurring {name}", report["recurring"][name], args.max_query_seconds) for name in ("events_between_week", "events_between_week_next_year")]
+    budgets.append(("recurring events_between_day_cold", report["recurring"]["events_between_day_cold"], args.max_cold_query_seconds))
+    budgets.append(("dense events_between_day_and_analysis_cold", report["dense"]["events_between_day_and_analysis_cold"], args.max_cold_query_seconds))
+    for size, result in report["calendar"].items():
+        budgets.append((f"calendar {size} events_between_week", result["events_between_week"], args.max_query_seconds))
+        budgets.append((f"calendar {size} events_between_week_cold", result["events_between_week_cold"], args.max_cold_query_seconds))
+    failures = [f"{name}: {result['median_s']:.3f}s > {budget}s" for name, result, budget in budgets if result["median_s"] > budget]
+    for failure in failures:
+        print(f"Budget exceeded: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Routing table for the questions answered directly from the calendar (route_intent / match_intent).
+#
+# Jalankan dari root repository:
+#   python benchmarks/intent_check.py
+#
+# Setiap baris berisi prompt, intent yang diharapkan (None = diteruskan ke model) dan rentang tanggal yang diharapkan
+# relatif terhadap NOW (hari pertama, jumlah hari). Keluar dengan status 1 jika ada prompt yang berubah rutenya.
+import os
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Senin, 19 Oktober 2026 pukul 09.00 WIB
+NOW = (2026, 10, 19, 9, 0)
+
+ROUTES = [
+    # Jadwal tanpa tanggal berarti hari ini
+    ("jadwal saya", "schedule", (0, 1)),
+    ("Jadwal saya besok", "schedule", (1, 1)),
+    ("jadwal saya hari ini", "schedule", (0, 1)),
+    ("jadwal saya minggu ini", "schedule", (0, 7)),
+    ("jadwalku besok", "schedule", (1, 1)),
+    ("acara saya hari ini", "schedule", (0, 1)),
+    ("Apa jadwal saya besok?", "schedule", (1, 1)),
+    ("Jadwal saya hari ini apa saja?", "schedule", (0, 1)),
+    ("Ada acara besok?", "schedule", (1, 1)),
+    ("What's my schedule?", "schedule", (0, 1)),
+    ("show my calendar", "schedule", (0, 1)),
+    ("What's on my schedule tomorrow?", "schedule", (1, 1)),
+    ("What do I have today?", "schedule", (0, 1)),
+    ("ARIA, what's on today?", "schedule", (0, 1)),
+    ("What's on my calendar for 25 December?", "schedule", (67, 1)),
+    ("Show me my schedule for Monday and Tuesday", "schedule", (0, 2)),
+    ("Do I have any meetings on 2026-10-21?", "schedule", (2, 1)),
+    ("What’s on my agenda next week?", "schedule", (7, 7)),
+    # Acara berikutnya menyebut rentangnya sendiri
+    ("acara berikutnya", "next_event", None),
+    ("Acara berikutnya apa?", "next_event", None),
+    ("kapan rapat selanjutnya", "next_event", None),
+    ("next event", "next_event", None),
+    ("What's my next meeting?", "next_event", None),
+    ("next meeting tomorrow", "next_event", (1, 1)),
+    # Waktu luang harus menyebut tanggal
+    ("Am I free on Friday?", "free_time", (4, 1)),
+    ("When am I free this week?", "free_time", (0, 7)),
+    ("Apakah saya kosong besok?", "free_time", (1, 1)),
+    ("Kapan saya luang minggu depan?", "free_time", (7, 7)),
+    # Pertanyaan lain tetap ke model
+    ("Give me a sugar-free breakfast idea", None, None),
+    ("What's on your mind, ARIA?", None, None),
+    ("What's up?", None, None),
+    ("Is the gym free on weekends?", None, None),
+    ("Translate 'free time' to Indonesian", None, None),
+    ("Apakah jadwal saya terlalu padat minggu ini?", None, None),
+    ("Can you plan my schedule tomorrow?", None, None),
+    ("Am I free tomorrow to play football?", None, None),
+    ("When am I free?", None, None),
+    ("show my calendar to my manager", None, None),
+    ("Tolong pindahkan jadwal saya besok", None, None),
+]
+
+
+def import_main():
+    os.environ.setdefault("DEFAULT_API_KEY", "benchmark")
+    os.environ.setdefault("DEFAULT_MODEL", "gpt-4o-mini")
+    os.environ["DEFAULT_CONVERSATION_DB"] = ""  # Jangan menulis percakapan ke disk
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def main():
+    aria = import_main()
+    wib_zone = aria.pytz.timezone('Asia/Jakarta')
+    now = wib_zone.localize(datetime(*NOW))
+    today = wib_zone.localize(datetime(*NOW[:3]))
+    mismatches = []
+
+    for prompt, expected_intent, expected_days in ROUTES:
+        expected_range = None
+        if expected_days:
+            first_day, length = expected_days
+            expected_range = (today + timedelta(days=first_day), today + timedelta(days=first_day + length))
+        actual = aria.match_intent(prompt, now)
+        expected = None if expected_intent is None else (expected_intent, expected_range)
+        if actual != expected:
+            mismatches.append(f"{prompt!r}: expected {expected}, got {actual}")
+
+    print(f"checked {len(ROUTES)} prompts, {len(mismatches)} mismatches")
+    for mismatch in mismatches:
+        print(mismatch, file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Load generator for ARIA: N concurrent simulated sessions driving the ConversationManager API.
+#
+# Jalankan dari root repository (server tiruan dijalankan otomatis di proses yang sama):
+#   python benchmarks/load_test.py --sessions 50 --turns 5 --stream --output load.json
+#
+# Gunakan --base-url untuk mengarah ke server lain (misalnya mock_openai.py di mesin terpisah).
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai import add_config_arguments, config_from_args, start_server
+
+PROMPTS = [
+    "Can you help me plan my week?",
+    "I have too many meetings on Monday, what should I move?",
+    "Suggest a good time for a workout.",
+    "Bagaimana cara membagi waktu kerja dan istirahat?",
+    "Summarize what we discussed so far.",
+]
+
+
+def import_main(base_url):
+    os.environ["DEFAULT_BASE_URL"] = base_url
+    os.environ.setdefault("DEFAULT_API_KEY", "mock")
+    os.environ.setdefault("DEFAULT_MODEL", "gpt-4o-mini")
+    os.environ["DEFAULT_CONVERSATION_DB"] = ""  # Jangan menulis percakapan uji beban ke disk
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def percentiles(values):
+    if not values:
+        return None
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+
+# Function to run one simulated session and append its turn results
+def run_session(aria, number, turns, stream, think_time, start_barrier, results, lock):
+    chat_manager = aria.ConversationManager()
+    chat_manager.stream = stream
+    start_barrier.wait()
+    for turn in range(turns):
+        prompt = PROMPTS[(number + turn) % len(PROMPTS)]
+        started = time.perf_counter()
+        first_token = None
+        if stream:
+            response = ""
+            for delta in chat_manager.stream_chat_completion(prompt):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                response += delta
+        else:
+            response = chat_manager.chat_completion(prompt) or ""
+        elapsed = time.perf_counter() - started
+        with lock:
+            results.append({
+                "latency_s": elapsed,
+                "first_token_s": first_token,
+                "ok": chat_manager.last_error is None and bool(response),
+                "rejected": chat_manager.rejection is not None,
+                "tokens": chat_manager.count_tokens(response) if response else 0,
+            })
+        if think_time:
+            time.sleep(think_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent ARIA sessions against an OpenAI-compatible server.")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--stream", action="store_true", help="use stream_chat_completion instead of chat_completion")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each session waits between turns")
+    parser.add_argument("--base-url", help="use this server instead of starting the local mock")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = start_server(config=config_from_args(args))
+        base_url = server.base_url
+    aria = import_main(base_url)
+
+    results = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(args.sessions + 1)
+    threads = [
+        threading.Thread(target=run_session, args=(aria, number, args.turns, args.stream, args.think_time, start_barrier, results, lock), daemon=True)
+        for number in range(args.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    succeeded = [result for result in results if result["ok"]]
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "base_url": base_url,
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "stream": args.stream,
+        "duration_s": duration,
+        "turns": len(results),
+        "failed_turns": len(results) - len(succeeded),
+        "rejected_turns": sum(result["rejected"] for result in results),
+        "throughput_turns_per_s": len(succeeded) / duration if duration else None,
+        "throughput_tokens_per_s": sum(result["tokens"] for result in succeeded) / duration if duration else None,
+        "turn_latency_s": percentiles([result["latency_s"] for result in succeeded]),
+        "first_token_s": percentiles([result["first_token_s"] for result in succeeded if result["first_token_s"] is not None]),
+    }
+    report["admission"] = aria.get_admission_controller().stats()
+    if server:
+        report["mock_server"] = server.RequestHandlerClass.config.stats()
+        server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# Local OpenAI-compatible stand-in for /v1/chat/completions, for load tests without spending tokens.
+#
+#   python benchmarks/mock_openai.py --port 8901 --latency 0.3 --tokens-per-second 50 --error-rate 0.05
+#   DEFAULT_BASE_URL=http://127.0.0.1:8901/v1 streamlit run main.py
+#
+# Mendukung respons biasa dan streaming (SSE), dengan latensi, kecepatan token dan injeksi error yang bisa diatur.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_WORDS = (
+    "Here is a suggestion for your schedule : keep your mornings for focused work , "
+    "move meetings to the afternoon and leave time for a short walk after lunch ."
+).split()
+
+
+# MockConfig class: behaviour of the stand-in server
+class MockConfig:
+    def __init__(self, latency=0.2, jitter=0.05, tokens_per_second=50.0, reply_tokens=60, error_rate=0.0, seed=None):
+        self.latency = latency  # Detik sebelum token pertama
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate  # Bagian permintaan yang dijawab 429 atau 500
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    # Function to draw the outcome of one request: the injected error status (None for success) and the delay
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            status = None
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                # Setengah error berupa rate limit dengan Retry-After, setengah lagi error server
+                status = 429 if self.random.random() < 0.5 else 500
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            return status, delay
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, seperti API sungguhan
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "aria"}]})
+        else:
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        status, delay = self.config.draw()
+        time.sleep(delay)
+        if status:
+            if status == 429:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"Retry-After": "0.1"})
+            else:
+                self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        model = body.get("model", "mock-model")
+        max_tokens = body.get("max_tokens") or self.config.reply_tokens
+        words = [REPLY_WORDS[position % len(REPLY_WORDS)] for position in range(min(self.config.reply_tokens, max_tokens))]
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        token_delay = 1 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for position, word in enumerate(words):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": word + " "} if position == 0 else {"content": word + " "}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(token_delay)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+                }
+                self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            return
+
+        time.sleep(token_delay * len(words))
+        self.send_json(200, {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+        })
+
+
+# Function to start the stand-in in a background thread; returns the server (its base URL is server.base_url)
+def start_server(host="127.0.0.1", port=0, config=None):
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.05, help="random +/- seconds added to the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="generation speed (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="tokens per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429 or 500")
+    parser.add_argument("--seed", type=int, help="random seed for latency and errors")
+
+
+def config_from_args(args):
+    return MockConfig(args.latency, args.jitter, args.tokens_per_second, args.reply_tokens, args.error_rate, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible mock server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, config_from_args(args))
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Randomized check of the recurring-event expansion against a brute-force dateutil expansion from DTSTART.
+#
+# Jalankan dari root repository:
+#   python benchmarks/recurrence_check.py --cases 1500 --seed 1
+#
+# Setiap kasus membuat acara berulang acak (zona waktu, acara sehari penuh, EXDATE, COUNT, UNTIL) dan jendela acak,
+# lalu membandingkan iter_occurrences dan CalendarManager.events_between dengan penguraian lengkap dari DTSTART.
+# Keluar dengan status 1 jika ada perbedaan.
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RULES = [
+    "FREQ=DAILY", "FREQ=DAILY;INTERVAL=3", "FREQ=WEEKLY;BYDAY=MO,WE,FR", "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,TH",
+    "FREQ=WEEKLY;INTERVAL=3", "FREQ=MONTHLY", "FREQ=MONTHLY;BYDAY=2TU", "FREQ=MONTHLY;INTERVAL=2;BYMONTHDAY=15,30",
+    "FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1", "FREQ=YEARLY", "FREQ=YEARLY;INTERVAL=2;BYMONTH=3;BYDAY=-1SU",
+    "FREQ=HOURLY;INTERVAL=5", "FREQ=DAILY;COUNT=400", "FREQ=HOURLY;INTERVAL=7;COUNT=30000", "FREQ=WEEKLY;BYDAY=SA;COUNT=900",
+    "FREQ=WEEKLY;UNTIL=20260301T000000Z;BYDAY=SA", "FREQ=MINUTELY;INTERVAL=90;BYHOUR=9,10,11", "FREQ=MINUTELY;INTERVAL=20",
+]
+ZONES = ["Asia/Jakarta", "Europe/London", "America/New_York", None]
+
+
+def import_main():
+    os.environ.setdefault("DEFAULT_API_KEY", "benchmark")
+    os.environ.setdefault("DEFAULT_MODEL", "gpt-4o-mini")
+    os.environ["DEFAULT_CONVERSATION_DB"] = ""  # Jangan menulis percakapan ke disk
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+# Function to expand every occurrence from DTSTART with plain dateutil and keep the ones overlapping the window
+def brute_force(main, event, window_start, window_end):
+    start = event['start']
+    all_day = not isinstance(start, datetime)
+    tz = main.recurrence_zone(start)
+    duration = event['end'] - start if event.get('end') else None
+    rules = main.rruleset()
+    rules.rrule(main.rrulestr(main.wall_time_until(event['rrule'], tz), dtstart=main.to_wall_time(start, tz)))
+    for exdate in event.get('exdate', ()):
+        rules.exdate(main.to_wall_time(exdate, tz))
+
+    # Waktu lokal berbeda paling banyak satu hari dari UTC; kejadian yang jelas sebelum jendela tidak perlu di-localize
+    wall_window_start = datetime(1970, 1, 1) + timedelta(seconds=window_start) - timedelta(days=2)
+    found = []
+    for wall_start in rules:
+        if wall_start + (duration or timedelta(0)) < wall_window_start:
+            continue
+        if all_day:
+            value = wall_start.date()
+        else:
+            value = wall_start if tz is None else tz.localize(wall_start)
+        occurrence = {"summary": event["summary"], "start": value, "end": value + duration if duration is not None else None}
+        occurrence_start, occurrence_end = main.event_timestamps(occurrence)
+        if occurrence_start >= window_end:
+            break
+        if occurrence_end > window_start or occurrence_start >= window_start:
+            found.append(occurrence)
+    return found
+
+
+# Function to build one random recurring event, or None when the random date does not exist
+def random_event(main, rng, number):
+    rule = rng.choice(RULES)
+    try:
+        if rng.random() < 0.15:
+            start = date(rng.randint(2015, 2025), rng.randint(1, 12), rng.randint(1, 31 if rng.random() < 0.2 else 28))
+            end = start + timedelta(days=1)
+        else:
+            zone = rng.choice(ZONES)
+            naive = datetime(rng.randint(2012, 2025), rng.randint(1, 12), rng.randint(1, 31), rng.randint(0, 23), rng.choice([0, 30]))
+            start = main.pytz.timezone(zone).localize(naive) if zone else naive
+            end = start + timedelta(minutes=rng.choice([30, 90, 600, 3000]))
+    except ValueError:
+        return None
+    event = {"summary": f"Rule {number}", "start": start, "end": end, "rrule": rule, "uid": f"rule-{number}@aria.example"}
+    if rng.random() < 0.3:
+        event["exdate"] = [start + timedelta(days=rng.randint(0, 4000))]
+    return event
+
+
+def occurrence_keys(occurrences):
+    return sorted((occurrence["summary"], str(occurrence["start"]), str(occurrence["end"])) for occurrence in occurrences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check recurring-event expansion against brute-force dateutil.")
+    parser.add_argument("--cases", type=int, default=1500, help="random single-rule cases")
+    parser.add_argument("--calendars", type=int, default=20, help="random calendars queried through CalendarManager")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    aria = import_main()
+    rng = random.Random(args.seed)
+    limit = aria.DEFAULT_MAX_OCCURRENCES_PER_RULE
+    checked, mismatches = 0, []
+
+    # Satu aturan, jendela acak sepanjang 2026 (jauh setelah DTSTART)
+    for number in range(args.cases):
+        event = random_event(aria, rng, number)
+        if event is None:
+            continue
+        window_start = datetime(2026, rng.randint(1, 12), rng.randint(1, 28), tzinfo=aria.pytz.utc).timestamp() + rng.randint(0, 86400)
+        window_end = window_start + rng.choice([3600, 86400, 7 * 86400, 60 * 86400])
+        expected = brute_force(aria, event, window_start, window_end)[:limit]
+        actual = list(aria.iter_occurrences(event, window_start, window_end))
+        checked += 1
+        if occurrence_keys(expected) != occurrence_keys(actual):
+            mismatches.append(f"{event['rrule']} from {event['start']}: expected {len(expected)}, got {len(actual)}")
+
+    # Beberapa aturan sekaligus lewat CalendarManager: jendela di sekitar hari ini memakai RecurrenceCache
+    now = datetime.now(aria.pytz.utc).timestamp()
+    for number in range(args.calendars):
+        events = [event for event in (random_event(aria, rng, f"{number}-{position}") for position in range(20)) if event]
+        calendar_manager = aria.CalendarManager()
+        calendar_manager.load_events(events)
+        for _ in range(5):
+            window_start = now + rng.randint(-80, 80) * 86400 + rng.randint(0, 86400)
+            window_end = window_start + rng.choice([3600, 86400, 7 * 86400])
+            expected = [occurrence for event in events for occurrence in brute_force(aria, event, window_start, window_end)[:limit]]
+            actual = calendar_manager._between(window_start, window_end)
+            checked += 1
+            if occurrence_keys(expected) != occurrence_keys(actual):
+                mismatches.append(f"calendar {number}: expected {len(expected)}, got {len(actual)} in [{window_start}, {window_end})")
+
+    print(f"checked {checked} cases, {len(mismatches)} mismatches")
+    for mismatch in mismatches[:20]:
+        print(mismatch, file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Startup benchmark for ARIA: import-time report and wall-clock time to the first render.
+#
+# Jalankan dari root repository:
+#   python benchmarks/startup.py --runs 5 --output startup.json
+#
+# Setiap pengukuran dijalankan di proses Python baru agar hasilnya mencerminkan cold start worker.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Script yang dijalankan di proses baru untuk mengukur render pertama dengan AppTest Streamlit
+FIRST_RENDER_SCRIPT = """
+import json, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_ready = time.perf_counter()
+app = AppTest.from_file("main.py", default_timeout=120)
+app.run()
+finished = time.perf_counter()
+print(json.dumps({
+    "streamlit_import_s": streamlit_ready - started,
+    "first_render_s": finished - streamlit_ready,
+    "exceptions": [str(exception.value) for exception in app.exception],
+}))
+"""
+
+
+def benchmark_env():
+    env = dict(os.environ)
+    env.setdefault("DEFAULT_API_KEY", "benchmark")
+    env.setdefault("DEFAULT_MODEL", "gpt-4o-mini")
+    return env
+
+
+# Function to run `python -X importtime` on main.py and report the modules main.py pulls in directly
+def import_time_report(top=15):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=benchmark_env(), capture_output=True, text=True,
+    )
+    main_ms = None
+    dependencies = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # Baris header
+        # Kedalaman impor ditandai dengan indentasi dua spasi per tingkat
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == "main":
+            main_ms = cumulative / 1000
+        elif depth == 1:
+            dependencies[name.strip()] = dependencies.get(name.strip(), 0) + cumulative / 1000
+
+    ranked = sorted(dependencies.items(), key=lambda item: item[1], reverse=True)
+    return {"total_ms": main_ms, "top_packages_ms": dict(ranked[:top])}
+
+
+# Function to measure the wall-clock time to the first render of main.py in a fresh process
+def first_render_time():
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_RENDER_SCRIPT],
+        cwd=ROOT, env=benchmark_env(), capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure ARIA cold start time.")
+    parser.add_argument("--runs", type=int, default=3, help="number of fresh-process runs per measurement")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    import_reports = [import_time_report() for _ in range(args.runs)]
+    render_reports = [first_render_time() for _ in range(args.runs)]
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_total_ms_median": statistics.median(report["total_ms"] for report in import_reports),
+        "import_top_packages_ms": import_reports[-1]["top_packages_ms"],
+        "streamlit_import_s_median": statistics.median(report["streamlit_import_s"] for report in render_reports),
+        "first_render_s_median": statistics.median(report["first_render_s"] for report in render_reports),
+        "first_render_exceptions": render_reports[-1]["exceptions"],
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Synthetic ICS generator for the ARIA benchmarks.
+#
+# Membuat kalender yang mirip ekspor Google Calendar: beberapa zona waktu, acara seharian,
+# acara berulang (RRULE + EXDATE), deskripsi panjang dengan karakter escape dan baris yang dilipat.
+#
+#   python benchmarks/synthetic_ics.py --events 10000 --output synthetic.ics
+import argparse
+import random
+from datetime import datetime, timedelta
+
+TIMEZONES = ["Asia/Jakarta", "Asia/Singapore", "Europe/London", "America/New_York"]
+SUMMARIES = [
+    "Team meeting", "Client call", "Project work", "Code review", "Gym", "Yoga", "Running",
+    "Lunch", "Dinner with family", "Reading", "Rapat mingguan", "Olahraga pagi", "Istirahat",
+]
+LOCATIONS = ["", "", "Office", "Ruang Rapat 2, Lantai 3", "Home", "https://meet.example.com/abc-defg-hij"]
+RRULES = [
+    "FREQ=WEEKLY;BYDAY=MO,WE,FR",
+    "FREQ=DAILY;COUNT=30",
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU",
+    "FREQ=MONTHLY;BYMONTHDAY=15",
+]
+LOREM = (
+    "Agenda: review progress, blockers; next steps. Catatan: bawa laptop, siapkan slide. "
+    "Notes from last time, including links and action items for everyone involved. "
+)
+
+
+def escape_text(value):
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+# Function to fold a content line at 75 octets as RFC 5545 requires
+def fold_line(line):
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        # Jangan memotong di tengah karakter UTF-8
+        while limit < len(data) and (data[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(data[:limit].decode("utf-8"))
+        data = data[limit:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def format_local(value):
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+# Function to generate the lines of one VEVENT
+def event_lines(rng, number, start_day, span_days, recurring_ratio, description_length):
+    start = start_day + timedelta(days=rng.randrange(span_days), minutes=rng.randrange(6 * 60, 22 * 60, 15))
+    duration = timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120, 180]))
+    lines = ["BEGIN:VEVENT", f"UID:synthetic-{number}@aria.example", f"SUMMARY:{escape_text(rng.choice(SUMMARIES))}"]
+
+    kind = rng.random()
+    if kind < 0.05:
+        # Acara seharian
+        lines.append(f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}")
+        lines.append(f"DTEND;VALUE=DATE:{(start + timedelta(days=1)).strftime('%Y%m%d')}")
+    elif kind < 0.35:
+        lines.append(f"DTSTART:{format_local(start)}Z")
+        lines.append(f"DTEND:{format_local(start + duration)}Z")
+    else:
+        tzid = rng.choice(TIMEZONES)
+        lines.append(f"DTSTART;TZID={tzid}:{format_local(start)}")
+        lines.append(f"DTEND;TZID={tzid}:{format_local(start + duration)}")
+
+    if kind >= 0.05 and rng.random() < recurring_ratio:
+        lines.append(f"RRULE:{rng.choice(RRULES)}")
+        if rng.random() < 0.5:
+            lines.append(f"EXDATE:{format_local(start + timedelta(days=7))}Z")
+
+    location = rng.choice(LOCATIONS)
+    if location:
+        lines.append(f"LOCATION:{escape_text(location)}")
+    if description_length:
+        length = rng.randrange(description_length // 2, description_length + 1)
+        description = (LOREM * (length // len(LOREM) + 1))[:length].replace(". ", ".\n", 2)
+        lines.append(f"DESCRIPTION:{escape_text(description)}")
+
+    # Komponen bersarang seperti VALARM harus dilewati oleh parser
+    if rng.random() < 0.2:
+        lines += ["BEGIN:VALARM", "ACTION:DISPLAY", "TRIGGER:-PT10M", "END:VALARM"]
+    lines.append("END:VEVENT")
+    return lines
+
+
+# Function to build a synthetic calendar as ICS bytes
+def generate_ics(events, seed=0, start_day=None, span_days=365, recurring_ratio=0.05, description_length=400):
+    rng = random.Random(seed)
+    start_day = start_day or datetime(datetime.now().year, 1, 1)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//ARIA//Synthetic Benchmark//EN", "CALSCALE:GREGORIAN"]
+    for tzid in TIMEZONES:
+        lines += ["BEGIN:VTIMEZONE", f"TZID:{tzid}", "END:VTIMEZONE"]
+    for number in range(events):
+        lines += event_lines(rng, number, start_day, span_days, recurring_ratio, description_length)
+    lines.append("END:VCALENDAR")
+    return "".join(fold_line(line) for line in lines).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ICS calendar.")
+    parser.add_argument("--events", type=int, default=1000, help="number of VEVENTs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recurring-ratio", type=float, default=0.05, help="share of timed events with an RRULE")
+    parser.add_argument("--description-length", type=int, default=400, help="maximum description length in characters")
+    parser.add_argument("--output", default="synthetic.ics")
+    args = parser.parse_args()
+
+    data = generate_ics(args.events, args.seed, recurring_ratio=args.recurring_ratio, description_length=args.description_length)
+    with open(args.output, "wb") as file:
+        file.write(data)
+    print(f"Wrote {args.events} events ({len(data) / (1024 * 1024):.1f} MB) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
-from openai import OpenAI
-import tiktoken
 import requests
 from dotenv import load_dotenv
 import os
+import io
+import time
+import random
+import json
+import hashlib
+import sqlite3
+import threading
+import weakref
+import socket
+import uuid
 import streamlit as st
-from icalendar import Calendar
 from datetime import datetime
 import pytz
-from datetime import datetime, timedelta
+from dateutil.rrule import rrulestr, rruleset
+from dateutil.relativedelta import relativedelta
+from datetime import datetime, timedelta, date, timezone
+import re
+from calendar import timegm
+from urllib.parse import urlparse
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from itertools import chain, islice
+from bisect import bisect_left
+from functools import lru_cache
 from streamlit_option_menu import option_menu
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
 
+# Library berat (openai, tiktoken, pandas, numpy, matplotlib) diimpor di dalam fungsi
+# yang memakainya, sehingga cold start worker tidak membayar semuanya sebelum render pertama.
 
 
 # Muat file .env
@@ -25,6 +41,218 @@ DEFAULT_MODEL = os.getenv("DEFAULT_MODEL")
 DEFAULT_TEMPERATURE = float(os.getenv("DEFAULT_TEMPERATURE", 0.6))
 DEFAULT_MAX_TOKENS = int(os.getenv("DEFAULT_MAX_TOKENS", 1096))
 DEFAULT_TOKEN_BUDGET = int(os.getenv("DEFAULT_TOKEN_BUDGET", 4096))
+DEFAULT_STREAM = os.getenv("DEFAULT_STREAM", "true").lower() == "true"
+DEFAULT_HISTORY_WINDOW = int(os.getenv("DEFAULT_HISTORY_WINDOW", 20))
+DEFAULT_CALENDAR_TOKEN_ALLOWANCE = int(os.getenv("DEFAULT_CALENDAR_TOKEN_ALLOWANCE", 1024))
+DEFAULT_CONTEXT_LOOKAHEAD_DAYS = int(os.getenv("DEFAULT_CONTEXT_LOOKAHEAD_DAYS", 14))
+# Jam kerja (WIB) untuk mencari waktu luang
+DEFAULT_WORKING_HOURS = os.getenv("DEFAULT_WORKING_HOURS", "08:00-17:00")
+DEFAULT_MIN_FREE_MINUTES = int(os.getenv("DEFAULT_MIN_FREE_MINUTES", 30))
+DEFAULT_AVAILABILITY_DAYS = int(os.getenv("DEFAULT_AVAILABILITY_DAYS", 7))
+DEFAULT_MAX_AVAILABILITY_DAYS = int(os.getenv("DEFAULT_MAX_AVAILABILITY_DAYS", 31))
+DEFAULT_AVAILABILITY_ONLY = os.getenv("DEFAULT_AVAILABILITY_ONLY", "false").lower() == "true"
+# Router intent lokal untuk pertanyaan jadwal sederhana
+DEFAULT_INTENT_ROUTER = os.getenv("DEFAULT_INTENT_ROUTER", "true").lower() == "true"
+DEFAULT_INTENT_MAX_EVENTS = int(os.getenv("DEFAULT_INTENT_MAX_EVENTS", 20))
+DEFAULT_NATIVE_CHARTS = os.getenv("DEFAULT_NATIVE_CHARTS", "true").lower() == "true"
+
+# Batas impor kalender per file
+DEFAULT_MAX_ICS_BYTES = int(os.getenv("DEFAULT_MAX_ICS_BYTES", 20 * 1024 * 1024))
+DEFAULT_MAX_EVENTS = int(os.getenv("DEFAULT_MAX_EVENTS", 100000))
+DEFAULT_RECURRENCE_HORIZON_DAYS = int(os.getenv("DEFAULT_RECURRENCE_HORIZON_DAYS", 90))
+# Batas kejadian satu aturan pengulangan per kueri (dan di cache); semua kejadian bersama dibatasi DEFAULT_MAX_EVENTS
+DEFAULT_MAX_OCCURRENCES_PER_RULE = int(os.getenv("DEFAULT_MAX_OCCURRENCES_PER_RULE", 10000))
+DEFAULT_PARSE_CACHE_BYTES = int(os.getenv("DEFAULT_PARSE_CACHE_BYTES", 256 * 1024 * 1024))
+
+# Endpoint metadata instance (bisa diarahkan ke server lokal untuk pengujian)
+INSTANCE_METADATA_URL = os.getenv("INSTANCE_METADATA_URL", "http://169.254.169.254")
+INSTANCE_METADATA_TTL = int(os.getenv("INSTANCE_METADATA_TTL", 3600))
+INSTANCE_METADATA_NEGATIVE_TTL = int(os.getenv("INSTANCE_METADATA_NEGATIVE_TTL", 300))
+
+# Pengaturan koneksi ke API (dipakai bersama oleh semua sesi)
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("DEFAULT_CONNECT_TIMEOUT", 5))
+DEFAULT_READ_TIMEOUT = float(os.getenv("DEFAULT_READ_TIMEOUT", 60))
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("DEFAULT_MAX_CONNECTIONS", 100))
+DEFAULT_MAX_KEEPALIVE = int(os.getenv("DEFAULT_MAX_KEEPALIVE", 20))
+DEFAULT_MAX_RETRIES = int(os.getenv("DEFAULT_MAX_RETRIES", 3))
+DEFAULT_RETRY_BASE_DELAY = float(os.getenv("DEFAULT_RETRY_BASE_DELAY", 0.5))
+DEFAULT_RETRY_MAX_DELAY = float(os.getenv("DEFAULT_RETRY_MAX_DELAY", 8))
+
+# Kontrol penerimaan permintaan ke API (per proses): batas laju, antrean tunggu, dan kuota per sesi (0 = tanpa batas)
+DEFAULT_MAX_REQUESTS_PER_SECOND = float(os.getenv("DEFAULT_MAX_REQUESTS_PER_SECOND", 5))
+DEFAULT_MAX_TOKENS_PER_MINUTE = int(os.getenv("DEFAULT_MAX_TOKENS_PER_MINUTE", 200000))
+DEFAULT_MAX_CONCURRENT_COMPLETIONS = int(os.getenv("DEFAULT_MAX_CONCURRENT_COMPLETIONS", 16))
+DEFAULT_ADMISSION_QUEUE = int(os.getenv("DEFAULT_ADMISSION_QUEUE", 32))
+DEFAULT_ADMISSION_TIMEOUT = float(os.getenv("DEFAULT_ADMISSION_TIMEOUT", 10))
+DEFAULT_SESSION_REQUESTS_PER_MINUTE = int(os.getenv("DEFAULT_SESSION_REQUESTS_PER_MINUTE", 10))
+DEFAULT_SESSION_TOKENS_PER_HOUR = int(os.getenv("DEFAULT_SESSION_TOKENS_PER_HOUR", 200000))
+
+# Pengaturan cache respons (opsional, hanya untuk temperature rendah)
+DEFAULT_CACHE_ENABLED = os.getenv("DEFAULT_CACHE_ENABLED", "false").lower() == "true"
+DEFAULT_CACHE_MAX_TEMPERATURE = float(os.getenv("DEFAULT_CACHE_MAX_TEMPERATURE", 0.2))
+DEFAULT_CACHE_SIZE = int(os.getenv("DEFAULT_CACHE_SIZE", 512))
+DEFAULT_CACHE_TTL = int(os.getenv("DEFAULT_CACHE_TTL", 3600))
+DEFAULT_CACHE_DB = os.getenv("DEFAULT_CACHE_DB")
+
+# Metrik per giliran: log JSON-lines lokal, endpoint Prometheus (/metrics) dan panel debug di sidebar
+DEFAULT_METRICS_LOG = os.getenv("DEFAULT_METRICS_LOG", "")
+DEFAULT_METRICS_PORT = int(os.getenv("DEFAULT_METRICS_PORT", 0))
+DEFAULT_DEBUG_PANEL = os.getenv("DEFAULT_DEBUG_PANEL", "false").lower() == "true"
+DEFAULT_STREAM_USAGE = os.getenv("DEFAULT_STREAM_USAGE", "false").lower() == "true"
+
+# Penyimpanan percakapan di SQLite, opsional: isi DEFAULT_CONVERSATION_DB dengan path file (mis. conversations.db) untuk mengaktifkan
+DEFAULT_CONVERSATION_DB = os.getenv("DEFAULT_CONVERSATION_DB", "")
+DEFAULT_HISTORY_TAIL = int(os.getenv("DEFAULT_HISTORY_TAIL", 200))
+
+# Penyimpanan session state bersama antar node: kosong (hanya di worker ini), sqlite:///path, atau redis://host:port/db
+DEFAULT_SESSION_BACKEND = os.getenv("DEFAULT_SESSION_BACKEND", "")
+DEFAULT_SESSION_TTL = int(os.getenv("DEFAULT_SESSION_TTL", 7 * 24 * 3600))
+
+# Kebijakan pelepasan memori sesi: sesi yang menganggur lebih dari TTL, atau yang paling lama tidak aktif
+# saat total memori worker melewati batas, dilepas dan dimuat ulang dari penyimpanan pada giliran berikutnya
+DEFAULT_SESSION_IDLE_TTL = int(os.getenv("DEFAULT_SESSION_IDLE_TTL", 3600))
+DEFAULT_SESSION_MEMORY_CAP = int(os.getenv("DEFAULT_SESSION_MEMORY_CAP", 512 * 1024 * 1024))
+DEFAULT_SESSION_MIN_IDLE = int(os.getenv("DEFAULT_SESSION_MIN_IDLE", 60))
+
+#---------------------metrics-------------------------------+
+
+# TurnTimer class: wall-clock spans (in seconds) of one rerun or one chat turn
+class TurnTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.usage = {}  # response.usage dari API
+        self.source = None  # "model", "cache", "local" atau "error"
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+# Function to copy the token counts from an API usage object
+def usage_counts(usage):
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens, "total_tokens": usage.total_tokens}
+
+# MetricsRegistry class: span histograms and counters for the whole process, with an optional JSON-lines sink
+class MetricsRegistry:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.histograms = {}  # span -> [count per bucket..., +Inf count, sum]
+        self.counters = {}  # (name, label, value) -> total
+
+    def _count(self, name, label=None, value=None, amount=1):
+        key = (name, label, value)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Function to record the spans, turn source and token usage of one rerun
+    def observe(self, record):
+        with self.lock:
+            for name, seconds in record["spans"].items():
+                histogram = self.histograms.setdefault(name, [0] * (len(self.BUCKETS) + 2))
+                for position, bound in enumerate(self.BUCKETS):
+                    if seconds <= bound:
+                        histogram[position] += 1
+                histogram[-2] += 1
+                histogram[-1] += seconds
+            self._count("aria_reruns_total")
+            if record.get("source"):
+                self._count("aria_turns_total", "source", record["source"])
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if kind in record.get("usage", {}):
+                    self._count("aria_tokens_total", "kind", kind.split("_")[0], record["usage"][kind])
+
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as log_file:
+                        log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"Error writing metrics log: {e}")
+
+    # Function to render every metric in the Prometheus text format
+    def render_prometheus(self):
+        lines = ["# TYPE aria_span_seconds histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(self.BUCKETS, histogram):
+                    lines.append(f'aria_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'aria_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'aria_span_seconds_sum{{span="{name}"}} {histogram[-1]}')
+                lines.append(f'aria_span_seconds_count{{span="{name}"}} {histogram[-2]}')
+            declared = set()
+            for (name, label, value), total in sorted(self.counters.items(), key=lambda item: tuple(map(str, item[0]))):
+                if name not in declared:
+                    lines.append(f"# TYPE {name} counter")
+                    declared.add(name)
+                labels = f'{{{label}="{value}"}}' if label else ""
+                lines.append(f"{name}{labels} {total}")
+        return "\n".join(lines) + "\n"
+
+# Function to serve /metrics for Prometheus from a background thread
+def start_metrics_server(registry, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError as e:
+        print(f"Error starting metrics server on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+# Shared metrics registry for the whole process (the /metrics server starts with it when a port is set)
+@st.cache_resource(show_spinner=False)
+def get_metrics_registry():
+    registry = MetricsRegistry(DEFAULT_METRICS_LOG or None)
+    if DEFAULT_METRICS_PORT:
+        start_metrics_server(registry, DEFAULT_METRICS_PORT)
+    return registry
+
+# Function to combine the rerun and turn spans into one record and hand it to the registry
+def finish_run_metrics(run_timer, turn_timer=None, session_id=None):
+    spans = dict(run_timer.spans)
+    record = {"ts": time.time(), "session_id": session_id, "spans": spans}
+    if turn_timer is not None:
+        spans.update(turn_timer.spans)
+        record["source"] = turn_timer.source
+        record["usage"] = turn_timer.usage
+    spans["rerun"] = run_timer.elapsed()
+    get_metrics_registry().observe(record)
+    return record
+
+# Timer untuk rerun Streamlit ini
+run_timer = TurnTimer()
+
+#---------------------metrics-------------------------------+
 
 st.set_page_config(
     page_title="ARIA Chatbot",
@@ -46,38 +274,609 @@ def convert_to_wib(utc_time):
         return utc_time.astimezone(wib_zone)
     return None
 
+# Function to get the start and end of an event in WIB (all-day dates start at midnight WIB)
+def event_bounds(event):
+    wib_zone = pytz.timezone('Asia/Jakarta')
+
+    def to_wib(value):
+        if isinstance(value, datetime):
+            return value.astimezone(wib_zone)
+        if isinstance(value, date):
+            return wib_zone.localize(datetime.combine(value, datetime.min.time()))
+        return None
+
+    start = to_wib(event.get('start'))
+    end = to_wib(event.get('end'))
+    if end is None and start is not None:
+        # Acara seharian tanpa DTEND berlangsung satu hari penuh
+        end = start if isinstance(event['start'], datetime) else start + timedelta(days=1)
+    return start, end
+
+# Function to load the tiktoken encoder for a model (tiktoken keeps loaded encoders in its own registry)
+def load_encoding(model):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+# Shared tokenizer registry: one encoder per model name, reused by every session in the process
+@st.cache_resource(show_spinner=False)
+def get_encoding(model):
+    return load_encoding(model)
+
+# Function to fill the shared tokenizer registry in a background thread, started once per process
+@st.cache_resource(show_spinner=False)
+def warm_up_tokenizer():
+    def load():
+        try:
+            get_encoding(DEFAULT_MODEL)
+        except Exception as e:
+            print(f"Error warming up tokenizer: {e}")
+
+    thread = threading.Thread(target=load, name="tokenizer-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# Shared client pool: one OpenAI client (and HTTP connection pool) per (base_url, api_key) in the process
+@st.cache_resource(show_spinner=False)
+def get_openai_client(base_url, api_key):
+    from openai import OpenAI, DefaultHttpxClient, Timeout, DEFAULT_CONNECTION_LIMITS
+
+    # Limits dan Timeout diambil dari paket HTTP yang dipakai openai sendiri (httpx atau httpx2, tergantung versinya)
+    Limits = type(DEFAULT_CONNECTION_LIMITS)
+    http_client = DefaultHttpxClient(
+        limits=Limits(
+            max_connections=DEFAULT_MAX_CONNECTIONS,
+            max_keepalive_connections=DEFAULT_MAX_KEEPALIVE,
+        ),
+        timeout=Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT),
+    )
+    # Retries are handled by call_with_retries so the backoff stays configurable
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+# Function to check whether a failed API call is worth retrying (rate limits, server errors, network errors)
+def is_retryable_error(error):
+    from openai import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+# Function to run an API request with jittered exponential backoff
+def call_with_retries(request, max_retries=None, on_rate_limit=None):
+    max_retries = DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return request()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = random.uniform(0, min(DEFAULT_RETRY_MAX_DELAY, DEFAULT_RETRY_BASE_DELAY * 2 ** attempt))
+
+            # Hormati header Retry-After dari server jika ada
+            response = getattr(e, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            if retry_after:
+                try:
+                    delay = max(delay, min(float(retry_after), DEFAULT_RETRY_MAX_DELAY))
+                except ValueError:
+                    pass
+
+            # Beri tahu pemanggil tentang 429 agar sesi lain ikut menunggu, bukan mencoba bersamaan
+            if on_rate_limit and getattr(e, "status_code", None) == 429:
+                on_rate_limit(delay)
+
+            print(f"Retrying API request in {delay:.2f}s after error: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+#---------------------admission-------------------------------+
+
+# TokenBucket class: `capacity` units that refill at `rate` units per second (not locked; the controller locks it)
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    # Function to get the seconds until `amount` units are available (a cost above the capacity waits for a full bucket)
+    def wait_time(self, amount, now):
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    # Function to return units that were reserved but not used
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+# AdmissionTicket class: the answer to one request for a slot; `used` is set to the real token count once it is known
+# (a plain object rather than an exception, because the cached controller outlives the classes of later reruns)
+class AdmissionTicket:
+    def __init__(self, session_id, cost, waited, reason=None, retry_after=0.0):
+        self.session_id = session_id
+        self.cost = cost
+        self.waited = waited
+        self.reason = reason  # None jika diterima, "busy" atau "quota" jika ditolak
+        self.retry_after = retry_after
+        self.used = None
+
+    @property
+    def admitted(self):
+        return self.reason is None
+
+# AdmissionController class: process-wide limits on concurrent completions, requests/sec and tokens/min,
+# with a bounded FIFO wait queue and per-session quotas. Turns that cannot start in time are refused at once.
+class AdmissionController:
+    MAX_SESSIONS = 10000  # Kuota sesi yang paling lama tidak aktif dilupakan (ember penuh lagi)
+
+    def __init__(self, requests_per_second=DEFAULT_MAX_REQUESTS_PER_SECOND, tokens_per_minute=DEFAULT_MAX_TOKENS_PER_MINUTE,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT_COMPLETIONS, max_waiting=DEFAULT_ADMISSION_QUEUE, timeout=DEFAULT_ADMISSION_TIMEOUT,
+                 session_requests_per_minute=DEFAULT_SESSION_REQUESTS_PER_MINUTE, session_tokens_per_hour=DEFAULT_SESSION_TOKENS_PER_HOUR):
+        self.lock = threading.Lock()
+        self.queue = deque()  # Condition milik tiap permintaan yang menunggu, urut kedatangan
+        self.buckets = []  # (ember, "requests" atau "tokens")
+        if requests_per_second > 0:
+            self.buckets.append((TokenBucket(requests_per_second, max(1.0, requests_per_second)), "requests"))
+        if tokens_per_minute > 0:
+            self.buckets.append((TokenBucket(tokens_per_minute / 60, tokens_per_minute), "tokens"))
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.session_requests_per_minute = session_requests_per_minute
+        self.session_tokens_per_hour = session_tokens_per_hour
+        self.sessions = OrderedDict()  # session_id -> [(ember, jenis)...]
+        self.paused_until = 0.0  # Setelah 429 dari API, semua permintaan baru menunggu sampai waktu ini
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {"busy": 0, "quota": 0}
+
+    def session_buckets(self, session_id):
+        buckets = self.sessions.get(session_id)
+        if buckets is None:
+            buckets = []
+            if self.session_requests_per_minute > 0:
+                buckets.append((TokenBucket(self.session_requests_per_minute / 60, self.session_requests_per_minute), "requests"))
+            if self.session_tokens_per_hour > 0:
+                buckets.append((TokenBucket(self.session_tokens_per_hour / 3600, self.session_tokens_per_hour), "tokens"))
+            self.sessions[session_id] = buckets
+            while len(self.sessions) > self.MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session_id)
+        return buckets
+
+    @staticmethod
+    def bucket_wait(buckets, cost, now):
+        return max((bucket.wait_time(cost if kind == "tokens" else 1, now) for bucket, kind in buckets), default=0.0)
+
+    # Function to get the seconds until the shared limits allow `cost` tokens (None while every slot is busy)
+    def wait_time(self, cost, now):
+        if self.in_flight >= self.max_concurrent:
+            return None
+        return max(self.paused_until - now, self.bucket_wait(self.buckets, cost, now), 0.0)
+
+    def reject(self, session_id, cost, waited, reason, retry_after):
+        self.rejected[reason] += 1
+        return AdmissionTicket(session_id, cost, waited, reason, retry_after)
+
+    # Function to wait for a slot for one request of about `cost` tokens; gives up early instead of hanging
+    def acquire(self, session_id, cost):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self.lock:
+            quota = self.session_buckets(session_id)
+            quota_wait = self.bucket_wait(quota, cost, started)
+            if quota_wait > 0:
+                return self.reject(session_id, cost, 0.0, "quota", quota_wait)
+
+            # Permintaan baru tidak menyalip yang sudah antre; hanya yang paling depan yang boleh mengambil slot
+            wait = self.wait_time(cost, started)
+            if wait != 0 or self.queue:
+                if len(self.queue) >= self.max_waiting:
+                    return self.reject(session_id, cost, 0.0, "busy", wait or self.timeout)
+                turn = threading.Condition(self.lock)
+                self.queue.append(turn)
+                try:
+                    while wait != 0 or self.queue[0] is not turn:
+                        remaining = deadline - time.monotonic()
+                        # Jangan menunggu jika sudah pasti tidak akan dapat giliran sebelum batas waktu
+                        if remaining <= 0 or (wait is not None and wait > remaining):
+                            return self.reject(session_id, cost, time.monotonic() - started, "busy", wait or self.timeout)
+                        # Yang paling depan bangun sendiri saat ember terisi lagi; yang lain dibangunkan saat maju ke depan
+                        turn.wait(wait if wait and self.queue[0] is turn else remaining)
+                        wait = self.wait_time(cost, time.monotonic())
+                finally:
+                    self.queue.remove(turn)
+                    self.wake_next()
+
+            now = time.monotonic()
+            for bucket, kind in self.buckets + quota:
+                bucket.take(cost if kind == "tokens" else 1, now)
+            self.in_flight += 1
+            self.admitted += 1
+            return AdmissionTicket(session_id, cost, now - started)
+
+    # Function to wake the request at the front of the queue (call with the lock held)
+    def wake_next(self):
+        if self.queue:
+            self.queue[0].notify()
+
+    # Function to free the slot and refund the reserved tokens the request did not use
+    def release(self, ticket):
+        with self.lock:
+            self.in_flight -= 1
+            if ticket.used is not None and ticket.used < ticket.cost:
+                unused = ticket.cost - ticket.used
+                for bucket, kind in self.buckets + self.sessions.get(ticket.session_id, []):
+                    if kind == "tokens":
+                        bucket.give_back(unused)
+            self.wake_next()
+
+    # Function to hold back new requests after the API answered 429
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": self.in_flight, "waiting": len(self.queue), "admitted": self.admitted, "rejected": dict(self.rejected)}
+
+# Shared admission controller for the whole process
+@st.cache_resource(show_spinner=False)
+def get_admission_controller():
+    return AdmissionController()
+
+# Function to build the friendly reply shown when a turn is refused
+def admission_message(ticket):
+    if ticket.reason == "quota":
+        minutes = max(1, round(ticket.retry_after / 60))
+        return f"You have sent a lot of messages in a short time. Please take a short break and try again in about {minutes} minute{'s' if minutes > 1 else ''}."
+    seconds = max(1, round(ticket.retry_after))
+    return f"ARIA is helping many people right now. Please try again in about {seconds} second{'s' if seconds > 1 else ''}."
+
+#---------------------admission-------------------------------+
+
+# CompletionCache class to reuse responses for identical requests (in-memory LRU plus optional SQLite tier)
+class CompletionCache:
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, db_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, response)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, response TEXT, expires_at REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS completions_expires ON completions (expires_at)")
+            self.db.commit()
+
+    # Function to build a canonical hash of the request parameters
+    @staticmethod
+    def make_key(model, temperature, max_tokens, messages):
+        payload = json.dumps(
+            {"model": model, "temperature": temperature, "max_tokens": max_tokens, "messages": messages},
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Function to look up a cached response, returns None on a miss or when the entry expired
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+
+            if self.db:
+                row = self.db.execute("SELECT response, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+                if row:
+                    self.db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self.db.commit()
+
+            self.misses += 1
+            return None
+
+    # Function to store a response in every tier (expired SQLite rows are deleted on the same write)
+    def set(self, key, response):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self._remember(key, response, expires_at)
+            if self.db:
+                self.db.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+                self.db.execute("INSERT OR REPLACE INTO completions (key, response, expires_at) VALUES (?, ?, ?)", (key, response, expires_at))
+                self.db.commit()
+
+    def _remember(self, key, response, expires_at):
+        self.entries[key] = (expires_at, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+# Shared completion cache for the whole process
+@st.cache_resource(show_spinner=False)
+def get_completion_cache():
+    return CompletionCache(DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL, DEFAULT_CACHE_DB)
+
+# ConversationStore class to keep every conversation in an append-only SQLite table
+class ConversationStore:
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")  # Pembaca tidak menunggu penulis
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, token_count INTEGER, created_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self.db.commit()
+
+    # Function to store a message, returns its row id
+    def append(self, session_id, message):
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO messages (session_id, role, content, token_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, message["role"], message["content"], message.get("token_count"), time.time()),
+            )
+            self.db.commit()
+            return cursor.lastrowid
+
+    # Function to load up to `limit` messages older than `before_id` (all the latest ones when None), oldest first
+    def messages(self, session_id, limit, before_id=None):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, role, content, token_count FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before_id if before_id is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+
+    # Function to count the stored messages of a session
+    def count(self, session_id):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    @staticmethod
+    def _message(row):
+        message = {"id": row[0], "role": row[1], "content": row[2]}
+        if row[3] is not None:
+            message["token_count"] = row[3]
+        return message
+
+# Shared conversation store for the whole process, None when persistence is disabled
+@st.cache_resource(show_spinner=False)
+def get_conversation_store():
+    if not DEFAULT_CONVERSATION_DB:
+        return None
+    try:
+        return ConversationStore(DEFAULT_CONVERSATION_DB)
+    except Exception as e:
+        print(f"Error opening conversation store: {e}")
+        return None
+
+# ConversationHistory class to keep the conversation with a running token total
+class ConversationHistory:
+    def __init__(self, count_tokens, system_message=None, store=None, session_id=None, max_turns=DEFAULT_HISTORY_TAIL, state=None):
+        self.count_tokens = count_tokens
+        self.pinned = []  # System messages, never evicted
+        self.turns = deque()  # User and assistant messages, oldest first
+        self.counted_tokens = 0
+        self.uncounted = []  # Pesan yang belum dihitung tokennya
+        self.store = store
+        self.session_id = session_id
+        self.max_turns = max_turns  # Batas pesan di memori; sisanya dibaca dari store saat dibutuhkan
+        self.stored_turns = 0
+        if system_message:
+            self.pin({"role": "system", "content": system_message})
+        if state is not None:
+            self.stored_turns = state["stored_turns"]
+            self.load_turns(state["turns"])
+        elif store:
+            self.resume()
+
+    # Function to load the latest turns of a stored session back into memory
+    def resume(self):
+        try:
+            self.stored_turns = self.store.count(self.session_id)
+            self.load_turns(self.store.messages(self.session_id, self.max_turns))
+        except Exception as e:
+            print(f"Error resuming conversation {self.session_id}: {e}")
+
+    def load_turns(self, messages):
+        for message in messages:
+            self.uncounted.append(message)
+            self.turns.append(message)
+
+    # Function to serialize the in-memory turns, without the render cache
+    def to_state(self):
+        return {
+            "turns": [{key: value for key, value in message.items() if key != "html"} for message in self.turns],
+            "stored_turns": self.stored_turns,
+        }
+
+    def __iter__(self):
+        return chain(self.pinned, self.turns)
+
+    def __len__(self):
+        return len(self.pinned) + len(self.turns)
+
+    # Running total; new messages are counted on first use so creating a session does not wait for the tokenizer
+    @property
+    def total_tokens(self):
+        while self.uncounted:
+            self.counted_tokens += self.message_tokens(self.uncounted.pop())
+        return self.counted_tokens
+
+    # Function to get the token count of a message, memoized on the message itself
+    def message_tokens(self, message):
+        if "token_count" not in message:
+            message["token_count"] = self.count_tokens(message['content'])
+        return message["token_count"]
+
+    # Function to add a system message that is kept regardless of the token budget
+    def pin(self, message, index=None):
+        self.uncounted.append(message)
+        if index is None:
+            self.pinned.append(message)
+        else:
+            self.pinned.insert(index, message)
+
+    # Function to remove a pinned system message
+    def unpin(self, message):
+        self.pinned = [pinned for pinned in self.pinned if pinned is not message]
+        self.counted_tokens = self.total_tokens - message["token_count"]
+
+    # Function to add a user or assistant message at the end of the conversation (save=False keeps it in memory until save())
+    def append(self, message, save=True):
+        self.uncounted.append(message)
+        self.turns.append(message)
+        if save:
+            self.save(message)
+
+    # Function to write an appended message to the conversation store
+    def save(self, message):
+        if not self.store:
+            return
+        try:
+            self.message_tokens(message)  # Disimpan bersama pesan agar resume tidak perlu menghitung ulang
+            message["id"] = self.store.append(self.session_id, message)
+            self.stored_turns += 1
+        except Exception as e:
+            print(f"Error storing message: {e}")
+            return
+        while len(self.turns) > self.max_turns:
+            self.evict_oldest()
+
+    # Function to take back the last message while it is not stored yet (a turn that never got a reply)
+    def discard(self, message):
+        if "id" in message or not self.turns or self.turns[-1] is not message:
+            return
+        self.counted_tokens = self.total_tokens
+        self.turns.pop()
+        self.counted_tokens -= message["token_count"]
+
+    # Function to count every user or assistant message, including the ones only kept on disk
+    def turn_count(self):
+        return max(self.stored_turns, len(self.turns))
+
+    # Function to get the last n user or assistant messages, oldest first, paging older ones from the store
+    def recent(self, n):
+        messages = list(islice(reversed(self.turns), n))[::-1]
+        missing = n - len(messages)
+        if missing > 0 and self.store and messages and "id" in messages[0]:
+            try:
+                messages = self.store.messages(self.session_id, missing, before_id=messages[0]["id"]) + messages
+            except Exception as e:
+                print(f"Error loading earlier messages: {e}")
+        return messages
+
+    # Function to drop the oldest user or assistant message
+    def evict_oldest(self):
+        if not self.turns:
+            return None
+        self.counted_tokens = self.total_tokens
+        message = self.turns.popleft()
+        self.counted_tokens -= message["token_count"]
+        return message
+
 # ConversationManager class to handle AI conversation
 class ConversationManager:
-    def __init__(self, api_key=None, base_url=None, model=None, temperature=None, max_tokens=None, token_budget=None):
+    def __init__(self, api_key=None, base_url=None, model=None, temperature=None, max_tokens=None, token_budget=None, session_id=None, history_state=None):
         self.api_key = api_key or DEFAULT_API_KEY
         self.base_url = base_url or DEFAULT_BASE_URL
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
 
         self.model = model or DEFAULT_MODEL
         self.temperature = temperature or DEFAULT_TEMPERATURE
         self.max_tokens = max_tokens or DEFAULT_MAX_TOKENS
         self.token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+        self.stream = DEFAULT_STREAM
+        self.calendar_token_allowance = DEFAULT_CALENDAR_TOKEN_ALLOWANCE
+        self.calendar_context = None
+        self.ai_response = ""
+        self.last_error = None
+        self.rejection = None  # AdmissionTicket giliran terakhir jika ditolak karena sibuk atau kuota
+        self.pending_message = None  # Pesan pengguna yang belum dijawab, baru disimpan bersama balasannya
+        self.released = False  # True setelah riwayat dilepas oleh kebijakan memori
+        self.quota_key = None  # Kunci kuota per sesi browser (tetap sama setelah Reset); session_id jika kosong
+        self.timings = TurnTimer()  # Span waktu giliran terakhir
 
         self.system_message = ("You are a friendly and supportive daily planner assistant, your name is ARIA (Assistant for Reminders, Information, and Agendas) and you generate a scheduke in GMT 07 OR indonesian hours only. You answer with kindness and patience. and breakdown to point point"
                                 "You are a helpful assistant named ARIA. "
                                 "You help with scheduling but always ask the user before adding or modifying their schedule. "
                                 "You generate suggestions with kindness and patience."
                                 "You have access to the user's imported calendar data. Use this information to help with scheduling and recommendations.")
-        self.conversation_history = [{"role": "system", "content": self.system_message}]
+        self.session_id = session_id or uuid.uuid4().hex
+        self.conversation_history = self.new_history(history_state)
+
+    # Function to create the history of the current session, resumed from the saved state or the store when it has one
+    def new_history(self, state=None):
+        return ConversationHistory(self.count_tokens, self.system_message, get_conversation_store(), self.session_id, state=state)
+
+    # Function to serialize the session settings and recent turns for the shared state backend
+    def to_state(self):
+        return {
+            "session_id": self.session_id,
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "token_budget": self.token_budget,
+            "stream": self.stream,
+            "calendar_token_allowance": self.calendar_token_allowance,
+            "history": self.conversation_history.to_state(),
+        }
+
+    # Function to rebuild a manager from to_state output (the API key and URL come from this node's environment)
+    @classmethod
+    def from_state(cls, state):
+        manager = cls(session_id=state["session_id"], history_state=state["history"])
+        for key in ("model", "temperature", "max_tokens", "token_budget", "stream", "calendar_token_allowance"):
+            setattr(manager, key, state[key])
+        return manager
+
+    # Client diambil dari pool bersama saat pertama dipakai, bukan saat sesi dibuat
+    @property
+    def client(self):
+        return get_openai_client(self.base_url, self.api_key)
 
     # Function to count tokens in a given text
     def count_tokens(self, text):
-        try:
-            encoding = tiktoken.encoding_for_model(self.model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
+        encoding = get_encoding(self.model)
         tokens = encoding.encode(text)
         return len(tokens)
+
+    # Function to build the message list sent to the API (without the memo fields)
+    def api_messages(self):
+        return [{"role": message["role"], "content": message["content"]} for message in self.conversation_history]
     
     # Function to calculate the total tokens used in the conversation
     def total_tokens_used(self):
         try:
-            return sum(self.count_tokens(message['content']) for message in self.conversation_history)
+            return self.conversation_history.total_tokens
         except Exception as e:
             print(f"Error calculating total tokens: {e}")
             return None
@@ -86,10 +885,10 @@ class ConversationManager:
     # Function to ensure the token usage does not exceed the budget
     def enforce_token_budget(self):
         try:
-            while self.total_tokens_used() > self.token_budget:
-                if len(self.conversation_history) <= 1:
-                    break
-                self.conversation_history.pop(1)
+            # Evict from the front until the running total fits, always keeping the latest message
+            history = self.conversation_history
+            while history.total_tokens > self.token_budget and len(history.turns) > 1:
+                history.evict_oldest()
         except Exception as e:
             print(f"Error enforcing token budget: {e}")
 
@@ -98,83 +897,917 @@ class ConversationManager:
         st.session_state["recommendation_added"] = False
 
 
-    # Function to get AI response based on user input
-    def chat_completion(self, prompt, temperature=None, max_tokens=None, model=None):
-
-        calendar_data = st.session_state.get("calendar_data", None)
+    # Function to add the calendar context and the user prompt to the conversation
+    def prepare_turn(self, prompt):
+        self.discard_pending()  # Giliran sebelumnya yang tidak selesai (stream ditutup di tengah jalan)
+        self.ai_response = ""
+        self.last_error = None
+        self.rejection = None
+        self.timings = TurnTimer()
+        calendar_manager = st.session_state.get("calendar_manager", None)
 
-        # Only add calendar to prompt if it exists and not previously added
+        # Refresh the calendar context with only the events relevant to this prompt
         recommendation_prompt = ""
-        if calendar_data and not st.session_state.get("recommendation_added", False):
-            activity_df, recommendation = analyze_activity_schedule(calendar_data)
-            calendar_info = "\n".join(
-                [f"Event: {event['summary']} | Start: {convert_to_wib(event['start']).strftime('%Y-%m-%d %H:%M')} | End: {convert_to_wib(event['end']).strftime('%Y-%m-%d %H:%M') if event['end'] else 'No End Time'}"
-                for event in calendar_data]
-            )
-            # Add calendar prompt as "system" message
-            self.conversation_history.insert(0, {
-                "role": "system",
-                "content": f"Here are some calendar events:\n{calendar_info}"
-            })
-            st.session_state["recommendation_added"] = True # Mark calendar as used
+        with self.timings.span("calendar_context"):
+            self.update_calendar_context(calendar_manager, prompt)
         
         prompt += recommendation_prompt  # Menambahkan prompt ke input pengguna
         
+        self.pending_message = {"role": "user", "content": prompt}
+        self.conversation_history.append(self.pending_message, save=False)
+        with self.timings.span("tokenization"):
+            self.conversation_history.total_tokens  # Hitung token pesan baru
+        with self.timings.span("budget_enforcement"):
+            self.enforce_token_budget()
+
+    # Function to replace the calendar "system" message with the events relevant to the prompt
+    def update_calendar_context(self, calendar_manager, prompt):
+        if self.calendar_context is not None:
+            self.conversation_history.unpin(self.calendar_context)
+            self.calendar_context = None
+
+        if not calendar_manager or not calendar_manager.events:
+            return
+
+        # Ringkasan waktu luang lebih hemat token daripada daftar acara, jadi diambil lebih dulu dari jatah token
+        availability = availability_summary(calendar_manager, prompt)
+        sections = []
+        if not DEFAULT_AVAILABILITY_ONLY:
+            allowance = self.calendar_token_allowance - self.count_tokens(availability)
+            calendar_info = select_calendar_context(calendar_manager, prompt, self.count_tokens, allowance)
+            if calendar_info:
+                sections.append(f"Here are some calendar events (times in WIB):\n{calendar_info}")
+        if availability:
+            sections.append(f"Free time within working hours ({DEFAULT_WORKING_HOURS} WIB):\n{availability}")
+        if not sections:
+            return
+
+        _, recommendation = calendar_manager.analysis()
+        sections.append(f"Schedule analysis: {recommendation}")
+        self.calendar_context = {
+            "role": "system",
+            "content": "\n".join(sections)
+        }
+        self.conversation_history.pin(self.calendar_context, index=0)
+
+    # Function to store the assistant reply in the conversation, together with the prompt it answers
+    def record_response(self, ai_response):
+        if self.pending_message is not None:
+            self.conversation_history.save(self.pending_message)
+            self.pending_message = None
+        self.ai_response = ai_response
+        self.conversation_history.append({"role": "assistant", "content": ai_response})
+
+    # Function to take the unanswered prompt back out of the conversation
+    def discard_pending(self):
+        if self.pending_message is not None:
+            self.conversation_history.discard(self.pending_message)
+            self.pending_message = None
+
+    # Function to record a turn answered locally by the intent router, without calling the model
+    def record_local_answer(self, prompt, reply):
+        self.discard_pending()
+        self.last_error = None
+        self.rejection = None
+        self.timings = TurnTimer()
+        self.timings.source = "local"
         self.conversation_history.append({"role": "user", "content": prompt})
+        self.record_response(reply)
         self.enforce_token_budget()
-        
+
+    # Function to get the shared completion cache when caching applies to this request
+    def completion_cache(self, temperature):
+        if DEFAULT_CACHE_ENABLED and temperature <= DEFAULT_CACHE_MAX_TEMPERATURE:
+            return get_completion_cache()
+        return None
+
+    # Function to reserve a slot with the shared admission controller, sized as the prompt plus the longest possible reply;
+    # returns None (and keeps the refusal in self.rejection, without the prompt in the history) when the turn has to be turned away
+    def admit(self, max_tokens):
+        ticket = get_admission_controller().acquire(self.quota_key or self.session_id, self.conversation_history.total_tokens + max_tokens)
+        if not ticket.admitted:
+            self.discard_pending()
+            self.rejection = ticket
+            self.timings.source = ticket.reason
+            print(f"Turn refused for session {self.session_id} ({ticket.reason}), retry after {ticket.retry_after:.1f}s")
+            return None
+        self.timings.record("admission_wait", ticket.waited)
+        return ticket
+
+    # Function to get AI response based on user input
+    def chat_completion(self, prompt, temperature=None, max_tokens=None, model=None):
+        self.prepare_turn(prompt)
+
         # Menggunakan parameter lain untuk mengatur respons AI
         temperature = temperature or self.temperature
         max_tokens = max_tokens or self.max_tokens
         model = model or self.model
-
+        messages = self.api_messages()
+
+        # Gunakan respons dari cache jika permintaan yang sama pernah dijawab
+        cache = self.completion_cache(temperature)
+        if cache:
+            cache_key = cache.make_key(model, temperature, max_tokens, messages)
+            with self.timings.span("cache_lookup"):
+                ai_response = cache.get(cache_key)
+            if ai_response is not None:
+                self.timings.source = "cache"
+                self.record_response(ai_response)
+                return ai_response
+
+        ticket = self.admit(max_tokens)
+        if ticket is None:
+            return None
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=self.conversation_history,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
+            with self.timings.span("api_total"):
+                response = call_with_retries(lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ), on_rate_limit=get_admission_controller().pause)
+            if response.usage:
+                ticket.used = response.usage.total_tokens
         except Exception as e:
             print(f"Error generating response: {e}")
+            self.discard_pending()  # Prompt yang gagal dijawab tidak ikut tersimpan di riwayat
+            self.last_error = e
+            self.timings.source = "error"
+            ticket.used = 0  # Permintaan yang gagal tidak memakai kuota; seluruh reservasi dikembalikan
             return None
+        finally:
+            get_admission_controller().release(ticket)
 
         ai_response = response.choices[0].message.content
-        self.ai_response = ai_response
-        self.conversation_history.append({"role": "assistant", "content": ai_response})
+        self.timings.source = "model"
+        self.timings.usage = usage_counts(response.usage)
+        self.record_response(ai_response)
+        if cache:
+            cache.set(cache_key, ai_response)
 
         return ai_response
 
+    # Function to stream the AI response as it is generated, yielding text deltas
+    def stream_chat_completion(self, prompt, temperature=None, max_tokens=None, model=None):
+        self.prepare_turn(prompt)
+
+        temperature = temperature or self.temperature
+        max_tokens = max_tokens or self.max_tokens
+        model = model or self.model
+        messages = self.api_messages()
+
+        cache = self.completion_cache(temperature)
+        if cache:
+            cache_key = cache.make_key(model, temperature, max_tokens, messages)
+            with self.timings.span("cache_lookup"):
+                ai_response = cache.get(cache_key)
+            if ai_response is not None:
+                self.timings.source = "cache"
+                yield ai_response
+                self.record_response(ai_response)
+                return
+
+        # Jumlah token hanya dikirim di akhir stream jika diminta (tidak semua server mendukung stream_options)
+        stream_options = {"stream_options": {"include_usage": True}} if DEFAULT_STREAM_USAGE else {}
+        ticket = self.admit(max_tokens)
+        if ticket is None:
+            return
+        chunks = []
+        started = time.perf_counter()
+        # Slot dipegang sampai stream selesai (atau ditutup), lalu token yang tidak terpakai dikembalikan
+        try:
+            stream = call_with_retries(lambda: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                **stream_options,
+            ), on_rate_limit=get_admission_controller().pause)
+            self.timings.record("api_first_byte", time.perf_counter() - started)
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    self.timings.usage = usage_counts(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not chunks:
+                        self.timings.record("api_first_token", time.perf_counter() - started)
+                    chunks.append(delta)
+                    yield delta
+            ticket.used = self.timings.usage.get("total_tokens") or ticket.cost - max_tokens + self.count_tokens("".join(chunks))
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            self.discard_pending()  # Prompt yang gagal dijawab tidak ikut tersimpan di riwayat
+            self.last_error = e
+            self.timings.source = "error"
+            return
+        finally:
+            self.timings.record("api_total", time.perf_counter() - started)
+            # Gagal atau ditutup di tengah jalan: hanya prompt dan token yang sudah diterima yang terpakai
+            if ticket.used is None:
+                ticket.used = ticket.cost - max_tokens + self.count_tokens("".join(chunks)) if chunks else 0
+            get_admission_controller().release(ticket)
+        self.timings.source = "model"
+
+        # Simpan balasan lengkap ke riwayat percakapan
+        ai_response = "".join(chunks)
+        self.record_response(ai_response)
+        if cache:
+            cache.set(cache_key, ai_response)
 
 
     # Function to reset the conversation history
+    # Riwayat lama tetap tersimpan; reset memulai sesi baru
     def reset_conversation_history(self):
-        self.conversation_history = [{"role": "system", "content": self.system_message}]
+        self.session_id = uuid.uuid4().hex
+        self.conversation_history = self.new_history()
+        self.calendar_context = None
+
+    # Function to drop the in-memory history of an idle session
+    def release(self):
+        self.conversation_history = ConversationHistory(self.count_tokens, self.system_message)
+        self.calendar_context = None
+        self.released = True
+
+    # Function to bring a released session back from the conversation store
+    def reload(self):
+        self.conversation_history = self.new_history()
+        self.released = False
 
     
 #---------------------calender-------------------------------+
+WIB_OFFSET_SECONDS = 7 * 3600
+
+# Function to get the start and end of an event in epoch seconds (same rules as event_bounds, without tz conversion)
+def event_timestamps(event):
+    def to_epoch(value):
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if isinstance(value, date):
+            return timegm(value.timetuple()) - WIB_OFFSET_SECONDS
+        return None
+
+    start = to_epoch(event.get('start'))
+    end = to_epoch(event.get('end'))
+    if end is None and start is not None:
+        end = start if isinstance(event['start'], datetime) else start + 86400
+    return start, end
+
+# Function to read an ICS stream line by line, joining folded continuation lines
+def unfold_ics_lines(stream, max_bytes=DEFAULT_MAX_ICS_BYTES):
+    read_bytes = 0
+    pending = None
+    for raw_line in stream:
+        read_bytes += len(raw_line)
+        if read_bytes > max_bytes:
+            raise ValueError(f"Calendar file is larger than {max_bytes // (1024 * 1024)} MB")
+        raw_line = raw_line.rstrip(b"\r\n")
+        # Baris lanjutan diawali spasi atau tab (RFC 5545 line folding)
+        if raw_line[:1] in (b" ", b"\t") and pending is not None:
+            pending += raw_line[1:]
+            continue
+        if pending is not None:
+            yield pending.decode("utf-8", errors="replace")
+        pending = raw_line
+    if pending is not None:
+        yield pending.decode("utf-8", errors="replace")
+
+# Function to split a content line into (name, params, value)
+def parse_ics_property(line):
+    colon = line.find(":")
+    if colon < 0:
+        return None
+    head = line[:colon]
+    if '"' in head:
+        # Nilai parameter dalam tanda kutip boleh berisi titik dua
+        in_quotes = False
+        for position, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ":" and not in_quotes:
+                colon = position
+                break
+        head = line[:colon]
+
+    name, *raw_params = head.split(";")
+    params = {}
+    for raw_param in raw_params:
+        key, _, value = raw_param.partition("=")
+        params[key.upper()] = value.strip('"')
+    return name.upper(), params, line[colon + 1:]
+
+ICS_TEXT_ESCAPES = {"n": "\n", "N": "\n", ",": ",", ";": ";", "\\": "\\"}
+
+# Function to unescape an ICS TEXT value
+def unescape_ics_text(value):
+    if "\\" not in value:
+        return value
+    return re.sub(r"\\(.)", lambda match: ICS_TEXT_ESCAPES.get(match.group(1), match.group(1)), value)
+
+# Function to convert an ICS DATE or DATE-TIME value into date/datetime
+def parse_ics_datetime(value, params):
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    if value.endswith("Z"):
+        return pytz.utc.localize(datetime.strptime(value[:15], "%Y%m%dT%H%M%S"))
+    parsed = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    tzid = params.get("TZID")
+    if tzid:
+        try:
+            return pytz.timezone(tzid).localize(parsed)
+        except pytz.exceptions.UnknownTimeZoneError:
+            pass
+    return parsed  # Floating time
+
+# Function to build an event dict from the properties of one VEVENT
+def build_ics_event(properties):
+    if "DTSTART" not in properties:
+        return None
+    params, value = properties["DTSTART"]
+    event = {
+        'summary': unescape_ics_text(properties["SUMMARY"][1]) if "SUMMARY" in properties else 'No Title',
+        'start': parse_ics_datetime(value, params),
+        'end': parse_ics_datetime(properties["DTEND"][1], properties["DTEND"][0]) if "DTEND" in properties else None,
+        'description': unescape_ics_text(properties["DESCRIPTION"][1]) if "DESCRIPTION" in properties else '',
+        'location': unescape_ics_text(properties["LOCATION"][1]) if "LOCATION" in properties else '',
+    }
+
+    # Data pengulangan hanya disimpan untuk acara berulang dan pengecualiannya
+    if "RRULE" in properties:
+        event['rrule'] = properties["RRULE"][1]
+    for key, name in (('rdate', "RDATE"), ('exdate', "EXDATE")):
+        if name in properties:
+            event[key] = [
+                parse_ics_datetime(value.split("/")[0], params)
+                for params, values in properties[name] for value in values.split(",")
+            ]
+    if "RECURRENCE-ID" in properties:
+        event['recurrence_id'] = parse_ics_datetime(properties["RECURRENCE-ID"][1], properties["RECURRENCE-ID"][0])
+    if (is_recurring(event) or 'recurrence_id' in event) and "UID" in properties:
+        event['uid'] = properties["UID"][1]
+    return event
+
+# Function to stream VEVENTs out of an ICS file one at a time, without building the whole calendar tree
+def iter_ics_events(stream, max_bytes=DEFAULT_MAX_ICS_BYTES):
+    properties = None
+    nested = 0  # Komponen di dalam VEVENT (mis. VALARM) diabaikan
+    for line in unfold_ics_lines(stream, max_bytes):
+        upper = line[:12].upper()
+        if upper.startswith("BEGIN:"):
+            if upper.startswith("BEGIN:VEVENT") and properties is None:
+                properties = {}
+            elif properties is not None:
+                nested += 1
+            continue
+        if upper.startswith("END:"):
+            if properties is None:
+                continue
+            if nested:
+                nested -= 1
+            elif upper.startswith("END:VEVENT"):
+                event = build_ics_event(properties)
+                properties = None
+                if event:
+                    yield event
+            continue
+        if properties is None or nested:
+            continue
+
+        parsed = parse_ics_property(line)
+        if not parsed:
+            continue
+        name, params, value = parsed
+        if name in ("RDATE", "EXDATE"):
+            properties.setdefault(name, []).append((params, value))
+        elif name not in properties:
+            properties[name] = (params, value)
+
+RECURRENCE_KEYS = ('rrule', 'rdate', 'exdate', 'uid')
+
+# Function to check whether an event repeats (RRULE or RDATE)
+def is_recurring(event):
+    return bool(event.get('rrule') or event.get('rdate'))
+
+# Function to express a date/datetime as a naive wall-clock time in the event timezone
+def to_wall_time(value, tz):
+    if not isinstance(value, datetime):
+        return datetime.combine(value, datetime.min.time())
+    if value.tzinfo is not None and tz is not None:
+        return value.astimezone(tz).replace(tzinfo=None)
+    return value.replace(tzinfo=None)
+
+# Function to rewrite a UTC UNTIL in an RRULE as wall-clock time, since expansion runs on naive datetimes
+def wall_time_until(rule, tz):
+    match = re.search(r"UNTIL=(\d{8}T\d{6})Z", rule, re.IGNORECASE)
+    if not match:
+        return rule
+    until = pytz.utc.localize(datetime.strptime(match.group(1), "%Y%m%dT%H%M%S"))
+    return rule.replace(match.group(0), "UNTIL=" + to_wall_time(until, tz).strftime("%Y%m%dT%H%M%S"))
+
+# Panjang satu periode untuk frekuensi RRULE yang bisa digeser dengan timedelta (pada waktu lokal)
+RRULE_PERIODS = {
+    "SECONDLY": timedelta(seconds=1),
+    "MINUTELY": timedelta(minutes=1),
+    "HOURLY": timedelta(hours=1),
+    "DAILY": timedelta(days=1),
+    "WEEKLY": timedelta(weeks=1),
+}
+
+# Function to get the fixed time between two occurrences of a rule: FREQ SECONDLY to WEEKLY without BYxxx parts,
+# so every period holds exactly one occurrence (None for any other rule)
+def rule_step(rule):
+    freq = re.search(r"FREQ=(\w+)", rule, re.IGNORECASE)
+    if not freq or freq.group(1).upper() not in RRULE_PERIODS or re.search(r"BY\w+=", rule, re.IGNORECASE):
+        return None
+    interval = re.search(r"INTERVAL=(\d+)", rule, re.IGNORECASE)
+    return RRULE_PERIODS[freq.group(1).upper()] * (int(interval.group(1)) if interval else 1)
+
+# Function to move DTSTART forward by whole rule periods to at most `not_before`, so expansion starts near
+# the queried window instead of walking every occurrence since the first one; returns (rule, dtstart)
+def advance_rule(rule, dtstart, not_before):
+    if dtstart >= not_before:
+        return rule, dtstart
+    freq = re.search(r"FREQ=(\w+)", rule, re.IGNORECASE)
+    freq = freq.group(1).upper() if freq else None
+    interval = re.search(r"INTERVAL=(\d+)", rule, re.IGNORECASE)
+    interval = int(interval.group(1)) if interval else 1
+
+    # COUNT dihitung dari DTSTART asli: hanya aturan satu-kejadian-per-periode yang bisa digeser, dengan COUNT dikurangi
+    count = re.search(r"COUNT=(\d+)", rule, re.IGNORECASE)
+    if count:
+        step = rule_step(rule)
+        if step is None:
+            return rule, dtstart
+        periods = min((not_before - dtstart) // step, int(count.group(1)) - 1)
+        if periods <= 0:
+            return rule, dtstart
+        return rule.replace(count.group(0), f"COUNT={int(count.group(1)) - periods}"), dtstart + step * periods
+
+    # Menggeser kelipatan INTERVAL periode menjaga fasenya, dan BYxxx yang diturunkan dari DTSTART tetap sama
+    if freq in RRULE_PERIODS:
+        step = RRULE_PERIODS[freq] * interval
+        return rule, dtstart + step * ((not_before - dtstart) // step)
+    if freq == "MONTHLY" and dtstart.day <= 28:
+        periods = ((not_before.year - dtstart.year) * 12 + not_before.month - dtstart.month - 1) // interval
+        return rule, dtstart + relativedelta(months=periods * interval) if periods > 0 else dtstart
+    if freq == "YEARLY" and (dtstart.month, dtstart.day) != (2, 29):
+        periods = (not_before.year - dtstart.year - 1) // interval
+        return rule, dtstart + relativedelta(years=periods * interval) if periods > 0 else dtstart
+    return rule, dtstart
+
+# Function to get the timezone recurring occurrences are computed in (None for all-day and floating events)
+def recurrence_zone(start):
+    tz = start.tzinfo if isinstance(start, datetime) else None
+    if tz is not None and hasattr(tz, "zone"):
+        tz = pytz.timezone(tz.zone)
+    return tz
+
+# Function to get a conservative epoch range holding every occurrence of a recurring event (end is inf when the rule never ends)
+def recurrence_span(event):
+    start, end = event_timestamps(event)
+    tz = recurrence_zone(event['start'])
+    margin = 86400 + (end - start)  # Waktu lokal dihitung seolah UTC, jadi beri kelonggaran satu hari plus durasi
+
+    def wall_epoch(value):
+        return timegm(to_wall_time(value, tz).timetuple())
+
+    try:
+        walls = [wall_epoch(rdate) for rdate in event.get('rdate', ())]
+        rule = event.get('rrule')
+        if rule:
+            rule = wall_time_until(rule, tz)
+            until = re.search(r"UNTIL=(\d{8})(T\d{6})?", rule, re.IGNORECASE)
+            count = re.search(r"COUNT=(\d+)", rule, re.IGNORECASE)
+            if count:
+                # Kejadian terakhir dihitung langsung jika langkahnya tetap; selain itu diuraikan dengan batas langkah
+                dtstart = to_wall_time(event['start'], tz)
+                step = rule_step(rule)
+                if step is not None:
+                    last = dtstart + step * (int(count.group(1)) - 1)
+                else:
+                    occurrences = list(islice(rrulestr(rule, dtstart=dtstart), DEFAULT_MAX_EVENTS + 1))
+                    if len(occurrences) > DEFAULT_MAX_EVENTS:
+                        return min([start] + walls) - margin, float("inf")
+                    last = occurrences[-1] if occurrences else dtstart
+                walls.append(timegm(last.timetuple()))
+            elif until:
+                walls.append(timegm(datetime.strptime(until.group(1), "%Y%m%d").timetuple()) + 86400)
+            else:
+                return min([start] + walls) - margin, float("inf")
+    except (ValueError, TypeError, OverflowError):
+        return float("-inf"), float("inf")  # iter_occurrences akan melaporkan aturannya
+    return min([start] + walls) - margin, max([start] + walls) + margin
+
+# Function to attach the event timezone to a wall-clock time (pytz localize is slow, and recurring events repeat the same times)
+@lru_cache(maxsize=65536)
+def localize_wall(tz, wall):
+    return tz.localize(wall) if hasattr(tz, "localize") else wall.replace(tzinfo=tz)
+
+# Function to lazily yield (start, start epoch, end epoch) for the occurrences of a recurring event
+# overlapping [window_start, window_end) in epoch seconds, without building the occurrence dicts;
+# stops after `limit` occurrences
+def iter_occurrence_times(event, window_start, window_end, limit=DEFAULT_MAX_OCCURRENCES_PER_RULE):
+    start = event['start']
+    all_day = not isinstance(start, datetime)
+    tz = recurrence_zone(start)
+    end = event.get('end')
+    duration = end - start if end else None
+
+    # Batas bawah jendela pada waktu lokal acara, dikurangi durasi dan kelonggaran: beberapa jam untuk pergantian DST,
+    # atau satu hari untuk acara tanpa zona waktu (dihitung seolah UTC)
+    if tz is not None:
+        window_wall = datetime.fromtimestamp(window_start, tz).replace(tzinfo=None)
+        slack = timedelta(hours=3)
+    else:
+        window_wall = datetime(1970, 1, 1) + timedelta(seconds=window_start)
+        slack = timedelta(days=1)
+    not_before = window_wall - (duration or timedelta(0)) - slack
+
+    # Pengulangan dihitung pada waktu lokal acara agar jamnya tetap saat DST berganti
+    try:
+        dtstart = to_wall_time(start, tz)
+        rules = rruleset()
+        if event.get('rrule'):
+            rule, rule_start = advance_rule(wall_time_until(event['rrule'], tz), dtstart, not_before)
+            rules.rrule(rrulestr(rule, dtstart=rule_start))
+        else:
+            rules.rdate(dtstart)
+        for rdate in event.get('rdate', ()):
+            rules.rdate(to_wall_time(rdate, tz))
+        for exdate in event.get('exdate', ()):
+            rules.exdate(to_wall_time(exdate, tz))
+    except (ValueError, TypeError, OverflowError) as e:
+        print(f"Error expanding recurring event {event.get('summary')}: {e}")
+        return
+
+    # Epoch dihitung sama seperti event_timestamps; offset pytz tidak berubah saat ditambah durasi
+    skipped = 0
+    for wall_start in rules:
+        if wall_start < not_before:
+            # Jelas sebelum jendela; aturan yang tidak bisa digeser dan terlalu rapat dihentikan
+            skipped += 1
+            if skipped > DEFAULT_MAX_EVENTS:
+                print(f"Recurring event {event.get('summary')} needs more than {DEFAULT_MAX_EVENTS} steps to reach the window; skipped")
+                return
+            continue
+        if limit <= 0:
+            return
+        if all_day:
+            value = wall_start.date()
+            start_time = timegm(value.timetuple()) - WIB_OFFSET_SECONDS
+        else:
+            value = wall_start if tz is None else localize_wall(tz, wall_start)
+            start_time = value.timestamp()
+        if duration is None:
+            end_time = start_time if not all_day else start_time + 86400
+        elif tz is None and not all_day:
+            end_time = (value + duration).timestamp()
+        else:
+            end_time = start_time + duration.total_seconds()
+
+        if start_time >= window_end:
+            return  # Aturan tak berujung berhenti di sini, hanya jendela yang diminta yang dihitung
+        if end_time > window_start or start_time >= window_start:
+            limit -= 1
+            yield value, start_time, end_time
+
+# Function to lazily yield the occurrences of a recurring event overlapping [window_start, window_end) in epoch seconds
+def iter_occurrences(event, window_start, window_end, limit=DEFAULT_MAX_OCCURRENCES_PER_RULE):
+    base = {key: value for key, value in event.items() if key not in RECURRENCE_KEYS}
+    duration = event['end'] - event['start'] if event.get('end') else None
+    for value, _, _ in iter_occurrence_times(event, window_start, window_end, limit):
+        yield dict(base, start=value, end=value + duration if duration is not None else None)
+
+# Function to expand recurring events over a window, at most DEFAULT_MAX_OCCURRENCES_PER_RULE per rule and `limit` in total;
+# `rules` holds (event, (first, last)) pairs and rules whose span misses the window are skipped
+def expand_window(rules, window_start, window_end, limit=DEFAULT_MAX_EVENTS):
+    found = []
+    for event, (first, last) in rules:
+        if first >= window_end or last <= window_start:
+            continue
+        room = min(DEFAULT_MAX_OCCURRENCES_PER_RULE, limit - len(found))
+        if room <= 0:
+            print(f"Recurring events stopped at {limit} occurrences for this window")
+            break
+        occurrences = list(iter_occurrences(event, window_start, window_end, room + 1))
+        if len(occurrences) > room:
+            print(f"Recurring event {event.get('summary')} has more than {room} occurrences in the window; the rest are skipped")
+            occurrences = occurrences[:room]
+        found.extend(occurrences)
+    return found
+
+# EventIndex class: events sorted by start with the max end of each subtree, for O(log n + k) overlap queries
+class EventIndex:
+    def __init__(self, events):
+        keyed = []
+        for event in events:
+            start, end = event_timestamps(event)
+            if start is not None:
+                keyed.append((start, end, event))
+        keyed.sort(key=lambda item: item[0])
+
+        self.starts = [item[0] for item in keyed]
+        self.ends = [item[1] for item in keyed]
+        self.events = [item[2] for item in keyed]
+        # Pohon implisit di atas array terurut: node untuk rentang [lo, hi) ada di indeks tengahnya
+        self.max_end = [0.0] * len(keyed)
+        self._build(0, len(keyed))
+        self.terms = None
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return float("-inf")
+        mid = (lo + hi) // 2
+        self.max_end[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self.max_end[mid]
+
+    # Function to get the events overlapping [start, end) in epoch seconds, ordered by start
+    def query(self, start, end):
+        found = []
+        self._query(0, len(self.starts), start, end, found)
+        return found
+
+    def _query(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_end[mid] < start:
+            return  # Semua acara di subtree ini sudah selesai sebelum rentang dimulai
+        self._query(lo, mid, start, end, found)
+        if self.starts[mid] >= end:
+            return  # Node ini dan subtree kanan dimulai setelah rentang berakhir
+        if self.ends[mid] > start or self.starts[mid] >= start:
+            found.append(self.events[mid])
+        self._query(mid + 1, hi, start, end, found)
+
+    # Function to find events sharing at least one keyword, built into an inverted index on first use
+    def matching(self, terms):
+        if self.terms is None:
+            self.terms = {}
+            for position, event in enumerate(self.events):
+                event_text = f"{event.get('summary', '')} {event.get('location', '')} {event.get('description', '')}"
+                for term in keyword_terms(event_text):
+                    self.terms.setdefault(term, []).append(position)
+
+        scores = {}
+        for term in terms:
+            for position in self.terms.get(term, ()):
+                scores[position] = scores.get(position, 0) + 1
+        return [(score, self.events[position]) for position, score in scores.items()]
+
+# RecurrenceCache class: the occurrence starts of every recurring event within the horizon around one day,
+# so window queries near "now" take a bisect per rule instead of a fresh expansion. Rules with more occurrences
+# than the per-rule cap or the remaining `limit` allow (e.g. FREQ=SECONDLY) are expanded per query instead.
+class RecurrenceCache:
+    def __init__(self, events, spans, day_start, limit=DEFAULT_MAX_EVENTS):
+        self.day_start = day_start
+        self.start, self.end = self.bounds(day_start)
+        self.rules = []  # (acara dasar, durasi, nilai start, epoch start, epoch end, durasi maksimum)
+        self.dense = []  # (acara, rentang) aturan yang hanya dihitung untuk jendela yang diminta
+        self.size = 0
+        for event, (first, last) in zip(events, spans):
+            if first >= self.end or last <= self.start:
+                continue
+            room = min(DEFAULT_MAX_OCCURRENCES_PER_RULE, limit - self.size)
+            values, starts, ends = [], [], []
+            for value, start_time, end_time in iter_occurrence_times(event, self.start, self.end, max(room, 0) + 1):
+                values.append(value)
+                starts.append(start_time)
+                ends.append(end_time)
+            if len(values) > room:
+                self.dense.append((event, (first, last)))
+            elif values:
+                base = {key: value for key, value in event.items() if key not in RECURRENCE_KEYS}
+                duration = event['end'] - event['start'] if event.get('end') else None
+                longest = max(end - start for start, end in zip(starts, ends))
+                self.rules.append((base, duration, values, starts, ends, longest))
+                self.size += len(values)
+
+    # Function to get the epoch range cached for a day: the horizon before it and after the end of it
+    @staticmethod
+    def bounds(day_start):
+        horizon = DEFAULT_RECURRENCE_HORIZON_DAYS * 86400
+        return day_start - horizon, day_start + horizon + 86400  # Juga mencakup "sekarang + horizon" sepanjang hari ini
+
+    # Function to build the occurrences overlapping [start, end) (same dicts iter_occurrences yields), at most `limit`
+    def between(self, start, end, limit=DEFAULT_MAX_EVENTS):
+        found = []
+        for base, duration, values, starts, ends, longest in self.rules:
+            for position in range(bisect_left(starts, start - longest), bisect_left(starts, end)):
+                if ends[position] > start or starts[position] >= start:
+                    value = values[position]
+                    found.append(dict(base, start=value, end=value + duration if duration is not None else None))
+        if self.dense:
+            found.extend(expand_window(self.dense, start, end, limit - len(found)))
+        return found[:limit]
+
+# EventColumns class: the calendar in columnar form (epoch arrays and categorical summaries) for vectorized analysis
+class EventColumns:
+    def __init__(self, events):
+        import numpy as np
+        import pandas as pd
+
+        count = len(events)
+        self.starts = np.zeros(count, dtype=np.int64)
+        self.ends = np.zeros(count, dtype=np.int64)
+        summaries = []
+        for position, event in enumerate(events):
+            start, end = event_timestamps(event)
+            if start is not None:
+                self.starts[position] = int(start)
+                self.ends[position] = int(end)
+            summaries.append(event.get('summary', 'No Title'))
+        self.summary_codes, self.summaries = pd.factorize(pd.Series(summaries, dtype=object))
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Function to get the duration of every event in hours
+    def durations(self):
+        return (self.ends - self.starts) / 3600
+
 # CalendarManager class to handle calendar functionality
 class CalendarManager:
     def __init__(self):
         self.events = []
-
-    # Function to parse an ICS file and extract calendar events
-    def parse_ics_file(self, ics_content):
+        self.error = None
+        self.version = 0  # Naik setiap kali acara diimpor atau ditambahkan
+        self._index = None
+        self._columns = None
+        self._analysis = None
+        self._recurring = []
+        self._recurring_spans = []  # (awal, akhir) epoch tiap acara berulang, untuk melewati aturan di luar jendela
+        self._occurrences = None  # RecurrenceCache untuk versi dan hari ini
+        self.digest = None  # SHA-256 file yang diimpor
+        self.added_events = []  # Acara yang ditambahkan setelah impor
+        self.released = False
+        self._memory = None
+
+    # Index dibangun ulang hanya saat daftar acara berubah; acara berulang disimpan terpisah
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = EventIndex([event for event in self.events if not is_recurring(event)])
+            self._recurring = [event for event in self.events if is_recurring(event)]
+            self._recurring_spans = [recurrence_span(event) for event in self._recurring]
+        return self._index
+
+    @property
+    def recurring(self):
+        self.index
+        return self._recurring
+
+    # Function to replace the events (e.g. with a parsed calendar from the cache)
+    def load_events(self, events):
+        self.events = list(events)
+        self.version += 1
+        self._index = None
+        self._occurrences = None
+        self._columns = None
+
+    # Function to add a single event (e.g. a suggested improvement) and invalidate the index
+    def add_event(self, event):
+        self.events.append(event)
+        self.added_events.append(event)
+        self.version += 1
+        self._index = None
+        self._occurrences = None
+        self._columns = None
+
+    # Function to get (activity_df, recommendation), recomputed only when the calendar version changes
+    def analysis(self):
+        if self._analysis is None or self._analysis[0] != self.version:
+            self._analysis = (self.version, analyze_activity_schedule(self.columns))
+        return self._analysis[1]
+
+    # Function to estimate the memory held by the events and the structures derived from them, in bytes
+    def memory_bytes(self):
+        if self._memory is None or self._memory[0] != self.version:
+            self._memory = (self.version, estimate_events_bytes(self.events))
+        size = self._memory[1]
+        if self._index is not None:
+            size += 104 * len(self._index.events)  # starts, ends, max_end (float) dan referensi acara
+        if self._columns is not None:
+            size += self._columns.starts.nbytes + self._columns.ends.nbytes + self._columns.summary_codes.nbytes
+        if self._analysis is not None:
+            size += int(self._analysis[1][0].memory_usage(deep=True).sum())
+        if self._occurrences is not None:
+            size += 120 * self._occurrences.size  # Nilai start (datetime) dan dua epoch per kejadian
+        return size
+
+    # Function to drop the events of an idle session; the list is cleared in place because session_state shares it
+    def release(self):
+        self.events.clear()
+        self.version += 1
+        self._index = None
+        self._columns = None
+        self._analysis = None
+        self._recurring = []
+        self._recurring_spans = []
+        self._occurrences = None
+        self.released = True
+
+    # Function to refill a released calendar with its imported events and the ones added afterwards
+    def reload(self, events):
+        self.events.extend(events)
+        self.events.extend(self.added_events)
+        self.version += 1
+        self.released = False
+
+    # Function to get the events (including recurring occurrences) overlapping a time range
+    def events_between(self, start, end):
+        return self._between(start.timestamp(), end.timestamp())
+
+    def _between(self, start, end):
+        found = self.index.query(start, end)
+        if self.recurring:
+            found.extend(self.recurring_between(start, end))
+            found.sort(key=lambda event: event_timestamps(event)[0])
+        return found
+
+    # Function to get the recurring occurrences overlapping [start, end) in epoch seconds, from the cache when it covers the range;
+    # together with the one-off events they stay within DEFAULT_MAX_EVENTS
+    def recurring_between(self, start, end):
+        limit = max(0, DEFAULT_MAX_EVENTS - len(self.index.events))
+        day_start = time.time() // 86400 * 86400
+        cached_start, cached_end = RecurrenceCache.bounds(day_start)
+        if cached_start <= start and end <= cached_end:
+            if self._occurrences is None or self._occurrences.day_start != day_start:
+                self._occurrences = RecurrenceCache(self.recurring, self._recurring_spans, day_start, limit)
+            return self._occurrences.between(start, end, limit)
+        return expand_window(zip(self.recurring, self._recurring_spans), start, end, limit)
+
+    # Function to find events sharing keywords with a prompt; recurring events report their next occurrence
+    def matching(self, terms, now):
+        found = self.index.matching(terms)
+        now = now.timestamp()
+        for event in self.recurring:
+            event_text = f"{event.get('summary', '')} {event.get('location', '')} {event.get('description', '')}"
+            score = len(terms & keyword_terms(event_text))
+            if score:
+                occurrence = next(iter_occurrences(event, now, now + DEFAULT_RECURRENCE_HORIZON_DAYS * 86400), None)
+                if occurrence:
+                    found.append((score, occurrence))
+        return found
+
+    # Kolom NumPy untuk analisis, dibangun sekali per perubahan data
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = EventColumns(self.expanded_events())
+        return self._columns
+
+    # Function to list the one-off events plus the recurring occurrences within the horizon around now
+    def expanded_events(self, now=None):
+        if not self.recurring:
+            return self.events
+        now = time.time() if now is None else now
+        horizon = DEFAULT_RECURRENCE_HORIZON_DAYS * 86400
+        expanded = [event for event in self.events if not is_recurring(event)]
+        expanded.extend(self.recurring_between(now - horizon, now + horizon))
+        return expanded
+
+    # Function to get the events on a given day in WIB
+    def events_on(self, day):
+        wib_zone = pytz.timezone('Asia/Jakarta')
+        start = wib_zone.localize(datetime.combine(day, datetime.min.time()))
+        return self.events_between(start, start + timedelta(days=1))
+
+    # Function to get the other events that overlap with an event
+    def overlapping(self, event):
+        start, end = event_timestamps(event)
+        if start is None:
+            return []
+        return [other for other in self._between(start, max(end, start + 1)) if other is not event]
+
+    # Function to parse an ICS file (bytes, text or a binary file object) and extract calendar events
+    def parse_ics_file(self, ics_content, max_bytes=DEFAULT_MAX_ICS_BYTES, max_events=DEFAULT_MAX_EVENTS):
+        self.error = None
         try:
-            cal = Calendar.from_ical(ics_content)
-            self.events = [
-                {
-                    'summary': str(component.get('summary', 'No Title')),
-                    'start': component.get('dtstart').dt,
-                    'end': component.get('dtend').dt if component.get('dtend') else None,
-                    'description': str(component.get('description', '')),
-                    'location': str(component.get('location', ''))
-                }
-                for component in cal.walk() if component.name == "VEVENT"
-            ]
+            if isinstance(ics_content, str):
+                ics_content = ics_content.encode("utf-8")
+            stream = io.BytesIO(ics_content) if isinstance(ics_content, bytes) else ics_content
+
+            events = []
+            for event in iter_ics_events(stream, max_bytes):
+                if len(events) >= max_events:
+                    raise ValueError(f"Calendar has more than {max_events} events")
+                events.append(event)
+
+            # Instance yang diubah (RECURRENCE-ID) menggantikan kemunculan aslinya
+            masters = {event['uid']: event for event in events if is_recurring(event) and 'uid' in event}
+            for event in events:
+                if 'recurrence_id' in event and event.get('uid') in masters:
+                    masters[event['uid']].setdefault('exdate', []).append(event['recurrence_id'])
+
+            self.load_events(events)
             return True
         except Exception as e:
             print(f"Error parsing ICS file: {e}")
+            self.error = str(e)
             return False
 
     def convert_to_wib(self, utc_time):
@@ -221,6 +1854,66 @@ st.markdown("""
 """, unsafe_allow_html=True)        
  
         
+# Function to copy an event dict together with its lists (rdate, exdate); the other values are immutable
+def copy_event(event):
+    return {key: list(value) if isinstance(value, list) else value for key, value in event.items()}
+
+# Function to estimate the memory held by a list of events, in bytes
+def estimate_events_bytes(events):
+    event_overhead = 600  # dict, datetime and string object headers
+    return sum(
+        event_overhead + len(event.get('summary', '')) + len(event.get('description', '')) + len(event.get('location', ''))
+        for event in events
+    )
+
+# ParseCache class: parsed calendars shared by every session, keyed by the SHA-256 of the uploaded bytes
+class ParseCache:
+    def __init__(self, max_bytes=DEFAULT_PARSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # digest -> (size_bytes, events)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    # Function to get a calendar's events; every caller gets its own copies, so one session cannot change another's
+    def get(self, digest):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            self.entries.move_to_end(digest)
+        return [copy_event(event) for event in entry[1]]
+
+    # Function to store parsed events, evicting the least recently used calendars beyond the size limit
+    def put(self, digest, events):
+        size_bytes = estimate_events_bytes(events)
+        with self.lock:
+            if digest in self.entries:
+                self.total_bytes -= self.entries.pop(digest)[0]
+            self.entries[digest] = (size_bytes, tuple(copy_event(event) for event in events))
+            self.total_bytes += size_bytes
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self.total_bytes -= self.entries.popitem(last=False)[1][0]
+
+# Shared parse cache for the whole process
+@st.cache_resource(show_spinner=False)
+def get_parse_cache():
+    return ParseCache(DEFAULT_PARSE_CACHE_BYTES)
+
+# Function to hash an uploaded file in chunks, once per upload (the digest is kept with the upload's file_id)
+def hash_upload(uploaded_file):
+    file_id = getattr(uploaded_file, "file_id", None)
+    memo = st.session_state.get("upload_digest")
+    if file_id and memo and memo[0] == file_id:
+        return memo[1]
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    if file_id:
+        st.session_state["upload_digest"] = (file_id, digest.hexdigest())
+    return digest.hexdigest()
+
 # Function to add calendar upload (outside Calendar Manager class)
 def add_calendar_upload():
     st.sidebar.markdown("""
@@ -231,44 +1924,846 @@ def add_calendar_upload():
     uploaded_file = st.sidebar.file_uploader("Upload Your ICS File", type=['ics'])
 
     if uploaded_file:
+        # Tolak file yang terlalu besar sebelum dibaca
+        if uploaded_file.size > DEFAULT_MAX_ICS_BYTES:
+            st.sidebar.error(f"Calendar file is too large (max {DEFAULT_MAX_ICS_BYTES // (1024 * 1024)} MB)")
+            return
+
+        # File yang sama dengan yang sudah diimpor tidak diproses ulang saat rerun
+        digest = hash_upload(uploaded_file)
+        if st.session_state.get("calendar_digest") == digest and "calendar_manager" in st.session_state:
+            st.sidebar.success("Calendar successfully imported!")
+            return
+
         calendar_manager = CalendarManager()
-        ics_content = uploaded_file.read()
+        parse_cache = get_parse_cache()
+        cached_events = parse_cache.get(digest)
+        if cached_events is not None:
+            calendar_manager.load_events(cached_events)
+            imported = True
+        else:
+            imported = calendar_manager.parse_ics_file(uploaded_file)
+            if imported:
+                parse_cache.put(digest, calendar_manager.events)
 
-        if calendar_manager.parse_ics_file(ics_content):
+        if imported:
             st.sidebar.success("Calendar successfully imported!")
+            calendar_manager.digest = digest
+            publish_calendar(digest, calendar_manager.events)
+            st.session_state["calendar_digest"] = digest
             st.session_state["calendar_added"] = False  # Reset calendar processing state
+            st.session_state["calendar_manager"] = calendar_manager
             st.session_state["calendar_data"] = calendar_manager.events
             st.session_state["schedule"] = calendar_manager.events  # Tambahkan ini
             st.session_state["calendar_prompt_added"] = False  # Reset flag for prompt addition
         else:
-            st.sidebar.error("Error importing calendar file")
+            st.sidebar.error(f"Error importing calendar file: {calendar_manager.error}")
 
 #---------------------calender-------------------------------+
 
 
+#---------------------session state-------------------------------+
+
+# Kunci session_state yang ikut disimpan selain chat_manager dan kalender
+SESSION_STATE_FLAGS = ("recommendation_added", "calendar_added", "calendar_prompt_added", "recommendation", "history_window")
+
+# Function to make datetimes and dates JSON-safe, keeping the pytz zone so recurring events still expand on local time
+def encode_state_value(value):
+    if isinstance(value, datetime):
+        encoded = {"__datetime__": value.replace(tzinfo=None).isoformat()}
+        if hasattr(value.tzinfo, "zone"):
+            encoded["tz"] = value.tzinfo.zone
+            encoded["dst"] = bool(value.dst())
+        elif value.tzinfo is not None:
+            encoded["offset"] = value.utcoffset().total_seconds()
+        return encoded
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+# Function to turn the values written by encode_state_value back into datetimes and dates
+def decode_state_value(value):
+    if "__datetime__" in value:
+        parsed = datetime.fromisoformat(value["__datetime__"])
+        if "tz" in value:
+            return pytz.timezone(value["tz"]).localize(parsed, is_dst=value.get("dst", False))
+        if "offset" in value:
+            return parsed.replace(tzinfo=timezone(timedelta(seconds=value["offset"])))
+        return parsed
+    if "__date__" in value:
+        return date.fromisoformat(value["__date__"])
+    return value
+
+def dump_state(state):
+    return json.dumps(state, default=encode_state_value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def load_state(raw):
+    return json.loads(raw, object_hook=decode_state_value)
+
+# SQLiteStateBackend class: key-value session state in a local SQLite file, shared by the workers of one host
+class SQLiteStateBackend:
+    def __init__(self, db_path, ttl=DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS session_state (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS session_state_expires ON session_state (expires_at)")
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value, expires_at FROM session_state WHERE key = ?", (key,)).fetchone()
+        if row and row[1] > time.time():
+            return row[0]
+        return None
+
+    # Function to store a value; rows past their TTL are deleted on the same write so the table does not grow forever
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.db.execute("DELETE FROM session_state WHERE expires_at <= ?", (now,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO session_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl),
+            )
+            self.db.commit()
+
+# RedisStateBackend class: key-value session state in Redis (or anything speaking RESP), through a minimal socket client
+class RedisStateBackend:
+    def __init__(self, url, ttl=DEFAULT_SESSION_TTL):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=DEFAULT_CONNECT_TIMEOUT)
+        self.reader = self.sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.database:
+            self._send("SELECT", self.database)
+
+    def _close(self):
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RuntimeError(f"Redis error: {payload.decode()}")
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    # Function to run a command, reconnecting once if the pooled connection went stale
+    def command(self, *args):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    return self._send(*args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key):
+        value = self.command("GET", key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value):
+        self.command("SET", key, value, "EX", self.ttl)
+
+# Shared session state backend for the whole process, None keeps the state in this worker only
+@st.cache_resource(show_spinner=False)
+def get_session_backend():
+    url = DEFAULT_SESSION_BACKEND
+    if not url:
+        return None
+    try:
+        if url.startswith("redis://"):
+            return RedisStateBackend(url, DEFAULT_SESSION_TTL)
+        return SQLiteStateBackend(url.removeprefix("sqlite:///"), DEFAULT_SESSION_TTL)
+    except Exception as e:
+        print(f"Error opening session backend: {e}")
+        return None
+
+# Function to publish a parsed calendar so other nodes can load it by digest
+def publish_calendar(digest, events):
+    backend = get_session_backend()
+    if not backend:
+        return
+    try:
+        backend.set(f"calendar:{digest}", dump_state(list(events)))
+    except Exception as e:
+        print(f"Error publishing calendar {digest}: {e}")
+
+# Function to get the events of a calendar digest from the local parse cache or the shared backend
+def fetch_calendar(backend, digest):
+    parse_cache = get_parse_cache()
+    events = parse_cache.get(digest)
+    if events is None:
+        raw = backend.get(f"calendar:{digest}") if backend else None
+        if raw is None:
+            return None
+        events = load_state(raw)
+        parse_cache.put(digest, events)
+    return events
+
+# Function to rebuild the session from the shared backend when another node saved a newer state
+def restore_session_state():
+    backend = get_session_backend()
+    session_id = st.query_params.get("session")
+    if not backend or not session_id:
+        return
+    try:
+        raw = backend.get(f"session:{session_id}")
+        if raw is None or raw == st.session_state.get("saved_state"):
+            return  # Salinan lokal sudah yang terbaru
+        state = load_state(raw)
+
+        st.session_state["chat_manager"] = ConversationManager.from_state(state["chat"])
+        calendar = state.get("calendar")
+        if calendar:
+            events = fetch_calendar(backend, calendar["digest"])
+            if events is not None:
+                calendar_manager = CalendarManager()
+                calendar_manager.load_events(events)
+                calendar_manager.digest = calendar["digest"]
+                for event in calendar["added"]:
+                    calendar_manager.add_event(event)
+                st.session_state["calendar_digest"] = calendar["digest"]
+                st.session_state["calendar_manager"] = calendar_manager
+                st.session_state["calendar_data"] = calendar_manager.events
+                st.session_state["schedule"] = calendar_manager.events
+        for key, value in state["flags"].items():
+            st.session_state[key] = value
+        st.session_state["saved_state"] = raw
+    except Exception as e:
+        print(f"Error restoring session {session_id}: {e}")
+
+# Function to write the session to the shared backend, skipped when nothing changed since the last save
+def save_session_state():
+    backend = get_session_backend()
+    if not backend or "chat_manager" not in st.session_state:
+        return
+    chat_manager = st.session_state["chat_manager"]
+    calendar_manager = st.session_state.get("calendar_manager")
+    state = {
+        "chat": chat_manager.to_state(),
+        "calendar": {"digest": calendar_manager.digest, "added": calendar_manager.added_events}
+        if calendar_manager and calendar_manager.digest else None,
+        "flags": {key: st.session_state[key] for key in SESSION_STATE_FLAGS if key in st.session_state},
+    }
+    try:
+        raw = dump_state(state)
+        if raw == st.session_state.get("saved_state"):
+            return
+        backend.set(f"session:{chat_manager.session_id}", raw)
+        st.session_state["saved_state"] = raw
+    except Exception as e:
+        print(f"Error saving session {chat_manager.session_id}: {e}")
+
+#---------------------session state-------------------------------+
+
+
+#---------------------memory-------------------------------+
+
+# Function to estimate the memory held by a conversation history, in bytes
+def estimate_history_bytes(history):
+    message_overhead = 400  # dict, string headers and memo fields
+    return sum(message_overhead + len(message["content"]) + len(message.get("html", "")) for message in history)
+
+# SessionRegistry class: approximate memory of every live session in this worker, for the idle and memory-cap eviction policy
+class SessionRegistry:
+    def __init__(self, idle_ttl=DEFAULT_SESSION_IDLE_TTL, memory_cap=DEFAULT_SESSION_MEMORY_CAP, min_idle=DEFAULT_SESSION_MIN_IDLE):
+        self.idle_ttl = idle_ttl
+        self.memory_cap = memory_cap
+        self.min_idle = min_idle  # Sesi yang baru saja aktif tidak pernah dilepas
+        self.entries = {}  # session key -> usage and weak references to its managers
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.kept = set()  # Sesi menganggur yang riwayatnya tetap di memori karena tidak bisa dibaca ulang
+
+    # Function to record that a session is active and how much memory it holds; returns its size in bytes
+    def touch(self, key, chat_manager, calendar_manager=None):
+        history_bytes = estimate_history_bytes(chat_manager.conversation_history)
+        calendar_bytes = calendar_manager.memory_bytes() if calendar_manager else 0
+        with self.lock:
+            self.entries[key] = {
+                "last_seen": time.time(),
+                "chat_manager": weakref.ref(chat_manager),
+                "calendar_manager": weakref.ref(calendar_manager) if calendar_manager else None,
+                "calendar_key": (calendar_manager.digest or id(calendar_manager)) if calendar_manager else None,
+                "history_bytes": history_bytes,
+                "calendar_bytes": calendar_bytes,
+                "running": False,
+            }
+            self.kept.discard(key)
+        return history_bytes + calendar_bytes
+
+    # Function to mark a session as active at the start of a run; until touch() at the end of the run its managers
+    # belong to its own script thread and are never released by another session
+    def mark_active(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["last_seen"] = time.time()
+                self.entries[key]["running"] = True
+
+    def total_bytes(self):
+        with self.lock:
+            return self._total_bytes()
+
+    # Kalender yang sama (digest sama) dipakai bersama dan hanya dihitung sekali
+    def _total_bytes(self):
+        calendars = {entry["calendar_key"]: entry["calendar_bytes"] for entry in self.entries.values() if entry["calendar_key"]}
+        return sum(entry["history_bytes"] for entry in self.entries.values()) + sum(calendars.values())
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.entries), "bytes": self._total_bytes(), "evictions": self.evictions, "kept": len(self.kept)}
+
+    # Function to release sessions idle past the TTL, then the least recently used ones while the worker is over the cap.
+    # Runs on the current session's thread, so it only touches sessions between runs: the lock keeps a session from
+    # starting a run while its managers are being released, and a run that never reached touch() counts after the TTL.
+    # Without a conversation store or state backend (release_history=False) only the calendars are released.
+    def evict(self, current_key, release_history=True):
+        now = time.time()
+        with self.lock:
+            # Tab yang sudah ditutup dibersihkan oleh garbage collector, cukup hapus entrinya
+            for key in [key for key, entry in self.entries.items() if entry["chat_manager"]() is None]:
+                del self.entries[key]
+                self.kept.discard(key)
+
+            candidates = sorted(
+                (entry["last_seen"], key) for key, entry in self.entries.items()
+                if key != current_key and now - entry["last_seen"] > self.min_idle
+                and not (entry["running"] and now - entry["last_seen"] <= self.idle_ttl)
+            )
+            for last_seen, key in candidates:
+                if now - last_seen <= self.idle_ttl and self._total_bytes() <= self.memory_cap:
+                    break
+                entry = self.entries[key]
+                if key in self.kept:
+                    continue
+                calendar_manager = entry["calendar_manager"]() if entry["calendar_manager"] else None
+                if calendar_manager:
+                    calendar_manager.release()
+                if release_history:
+                    chat_manager = entry["chat_manager"]()
+                    if chat_manager:
+                        chat_manager.release()
+                    del self.entries[key]
+                else:
+                    # Riwayat yang dilepas akan hilang, jadi tetap disimpan dan dilaporkan di sidebar
+                    entry.update(calendar_manager=None, calendar_key=None, calendar_bytes=0)
+                    self.kept.add(key)
+                if release_history or calendar_manager:
+                    self.evictions += 1
+
+# Shared session registry for the whole process
+@st.cache_resource(show_spinner=False)
+def get_session_registry():
+    return SessionRegistry(DEFAULT_SESSION_IDLE_TTL, DEFAULT_SESSION_MEMORY_CAP, DEFAULT_SESSION_MIN_IDLE)
+
+# Function to get the registry key of this browser session (stable across conversation resets)
+def session_memory_key():
+    if "memory_key" not in st.session_state:
+        st.session_state["memory_key"] = uuid.uuid4().hex
+    return st.session_state["memory_key"]
+
+# Function to rebuild a session whose state was released by the eviction policy; returns True when it already
+# read the shared backend during this run
+def reload_released_session():
+    chat_manager = st.session_state.get("chat_manager")
+    restored = chat_manager is not None and chat_manager.released
+    if restored:
+        # Dengan backend bersama, seluruh sesi dibangun ulang dari state yang tersimpan
+        st.session_state.pop("saved_state", None)
+        restore_session_state()
+        if st.session_state["chat_manager"] is not chat_manager:
+            return True
+        chat_manager.reload()
+
+    # Kalender bisa dilepas sendiri, tanpa riwayat (lihat SessionRegistry.evict)
+    calendar_manager = st.session_state.get("calendar_manager")
+    if calendar_manager and calendar_manager.released:
+        events = fetch_calendar(get_session_backend(), calendar_manager.digest) if calendar_manager.digest else None
+        if events is not None:
+            calendar_manager.reload(events)
+        else:
+            # File yang masih ada di uploader akan diimpor ulang
+            for key in ("calendar_manager", "calendar_data", "schedule", "calendar_digest"):
+                st.session_state.pop(key, None)
+    return restored
+
+# Function to record this session's memory and apply the eviction policy to the other sessions of the worker
+def track_session_memory():
+    if "chat_manager" not in st.session_state:
+        return
+    registry = get_session_registry()
+    key = session_memory_key()
+    st.session_state["session_bytes"] = registry.touch(key, st.session_state["chat_manager"], st.session_state.get("calendar_manager"))
+    registry.evict(key, release_history=bool(get_conversation_store() or get_session_backend()))
+
+get_session_registry().mark_active(session_memory_key())
+if not reload_released_session():
+    restore_session_state()
+
+#---------------------memory-------------------------------+
+
+
+
+#---------------------context-------------------------------+
+
+# Nama bulan dan hari (Inggris dan Indonesia) untuk mengenali tanggal di pesan pengguna
+MONTH_NAMES = {
+    "january": 1, "januari": 1, "jan": 1, "february": 2, "februari": 2, "feb": 2,
+    "march": 3, "maret": 3, "mar": 3, "april": 4, "apr": 4, "may": 5, "mei": 5,
+    "june": 6, "juni": 6, "jun": 6, "july": 7, "juli": 7, "jul": 7,
+    "august": 8, "agustus": 8, "aug": 8, "agu": 8, "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oktober": 10, "oct": 10, "okt": 10, "november": 11, "nov": 11,
+    "december": 12, "desember": 12, "dec": 12, "des": 12,
+}
+WEEKDAY_NAMES = {
+    "monday": 0, "senin": 0, "tuesday": 1, "selasa": 1, "wednesday": 2, "rabu": 2,
+    "thursday": 3, "kamis": 3, "friday": 4, "jumat": 4, "saturday": 5, "sabtu": 5,
+    "sunday": 6, "minggu": 6,
+}
+RELATIVE_DAYS = [
+    (r"\b(day after tomorrow|lusa)\b", 2),
+    (r"\b(tomorrow|besok)\b", 1),
+    (r"\b(yesterday|kemarin)\b", -1),
+    (r"\b(today|tonight|hari ini|malam ini|sekarang)\b", 0),
+]
+STOPWORDS = {
+    "the", "and", "for", "what", "when", "where", "with", "have", "about", "this", "that", "next",
+    "week", "today", "tomorrow", "schedule", "event", "events", "calendar", "please", "can", "you",
+    "apa", "yang", "dan", "untuk", "saya", "aku", "ada", "jadwal", "acara", "hari", "ini", "besok",
+    "minggu", "depan", "kapan", "dengan", "tolong", "bisa", "dong",
+}
+
+# Function to find the date range mentioned in a prompt (today, tomorrow, this week, explicit dates)
+def parse_date_range(prompt, now=None):
+    wib_zone = pytz.timezone('Asia/Jakarta')
+    now = now or datetime.now(wib_zone)
+    today = now.date()
+    text = prompt.lower()
+    days = []  # (first_day, number_of_days)
+
+    for pattern, offset in RELATIVE_DAYS:
+        if re.search(pattern, text):
+            days.append((today + timedelta(days=offset), 1))
+
+    week_start = today - timedelta(days=today.weekday())
+    if re.search(r"\b(this week|minggu ini|pekan ini)\b", text):
+        days.append((week_start, 7))
+    if re.search(r"\b(next week|minggu depan|pekan depan)\b", text):
+        days.append((week_start + timedelta(days=7), 7))
+    if re.search(r"\b(this month|bulan ini)\b", text):
+        month_start = today.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        days.append((month_start, (next_month - month_start).days))
+
+    # Nama hari berarti hari tersebut berikutnya (termasuk hari ini)
+    for name, weekday in WEEKDAY_NAMES.items():
+        if name == "minggu" and re.search(r"\bminggu (ini|depan|lalu)\b", text):
+            continue
+        if re.search(rf"\b{name}\b", text):
+            days.append((today + timedelta(days=(weekday - today.weekday()) % 7), 1))
+
+    # Tanggal eksplisit: 2024-12-25, 25/12/2024, 25 Desember (2024)
+    for year, month, day in re.findall(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b", text):
+        days.append((safe_date(year, month, day), 1))
+    for day, month, year in re.findall(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b", text):
+        days.append((safe_date(year, month, day), 1))
+    for day, month_name, year in re.findall(r"\b(\d{1,2}) ([a-z]+)(?: (\d{4}))?\b", text):
+        if month_name in MONTH_NAMES:
+            days.append((safe_date(year or today.year, MONTH_NAMES[month_name], day), 1))
+
+    days = [(first_day, length) for first_day, length in days if first_day]
+    if not days:
+        return None
+    start = min(first_day for first_day, _ in days)
+    end = max(first_day + timedelta(days=length) for first_day, length in days)
+    return (
+        wib_zone.localize(datetime.combine(start, datetime.min.time())),
+        wib_zone.localize(datetime.combine(end, datetime.min.time())),
+    )
+
+def safe_date(year, month, day):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+# Function to split text into lowercase keywords for matching
+def keyword_terms(text):
+    return {term for term in re.findall(r"\w+", text.lower()) if len(term) > 2 and term not in STOPWORDS}
+
+# Function to format a single event as one line of calendar context
+def format_event_line(event):
+    start, end = event_bounds(event)
+    line = f"Event: {event['summary']} | Start: {start.strftime('%Y-%m-%d %H:%M')} | End: {end.strftime('%Y-%m-%d %H:%M') if event.get('end') else 'No End Time'}"
+    if event.get('location'):
+        line += f" | Location: {event['location']}"
+    return line
+
+# Function to pick the events relevant to a prompt and format them within a token allowance
+def select_calendar_context(calendar_manager, prompt, count_tokens, token_allowance, now=None):
+    wib_zone = pytz.timezone('Asia/Jakarta')
+    now = now or datetime.now(wib_zone)
+    date_range = parse_date_range(prompt, now)
+    terms = keyword_terms(prompt)
+
+    # Kandidat: acara dalam rentang tanggal yang disebut, atau acara yang cocok dengan kata kunci
+    # ditambah acara yang akan datang. Diurutkan berdasarkan skor kata kunci lalu waktu mulai.
+    if date_range:
+        candidates = calendar_manager.events_between(*date_range)
+        ranked = []
+        for position, event in enumerate(candidates):
+            event_text = f"{event.get('summary', '')} {event.get('location', '')} {event.get('description', '')}"
+            score = len(terms & keyword_terms(event_text)) if terms else 0
+            ranked.append((-score, position, event))
+    else:
+        matches = sorted(calendar_manager.matching(terms, now), key=lambda item: -item[0]) if terms else []
+        upcoming = calendar_manager.events_between(now, now + timedelta(days=DEFAULT_CONTEXT_LOOKAHEAD_DAYS))
+        ranked = [(-score, position, event) for position, (score, event) in enumerate(matches)]
+        ranked += [(0, len(ranked) + position, event) for position, event in enumerate(upcoming)]
+    ranked.sort(key=lambda item: item[:2])
+
+    # Ambil acara sebanyak yang muat dalam jatah token; sisanya hanya dihitung sebagai kandidat yang tidak ditampilkan
+    selected = []
+    seen = set()
+    used_tokens = 0
+    full = False
+    for _, _, event in ranked:
+        start, _ = event_bounds(event)
+        if (event['summary'], start) in seen:
+            continue
+        seen.add((event['summary'], start))
+        if full:
+            continue
+        line = format_event_line(event)
+        line_tokens = count_tokens(line) + 1
+        if used_tokens + line_tokens > token_allowance:
+            full = True
+            continue
+        selected.append((start, line))
+        used_tokens += line_tokens
+
+    selected.sort(key=lambda item: item[0])
+    lines = [line for _, line in selected]
+    omitted = len(seen) - len(lines)
+    if lines and omitted > 0:
+        lines.append(f"({omitted} other events not shown)")
+    return "\n".join(lines)
+
+#---------------------context-------------------------------+
+
+
+#---------------------availability-------------------------------+
+
+# Function to parse working hours like "08:00-17:00" into minutes after midnight
+def parse_working_hours(value):
+    try:
+        start, end = (part.strip().split(":") for part in value.split("-"))
+        start_minutes = int(start[0]) * 60 + int(start[1] if len(start) > 1 else 0)
+        end_minutes = int(end[0]) * 60 + int(end[1] if len(end) > 1 else 0)
+        if 0 <= start_minutes < end_minutes <= 24 * 60:
+            return start_minutes, end_minutes
+    except ValueError:
+        pass
+    print(f"Error parsing working hours {value!r}, using 08:00-17:00")
+    return 8 * 60, 17 * 60
+
+WORKING_HOURS = parse_working_hours(DEFAULT_WORKING_HOURS)
+
+# Function to merge overlapping (start, end) intervals: sort once, then one sweep, O(n log n)
+def merge_busy_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+# Function to find the free slots of each day within WIB working hours, as {date: [(start, end), ...]} in epoch seconds
+def find_free_slots(calendar_manager, first_day, days, working_hours=None, min_minutes=DEFAULT_MIN_FREE_MINUTES, not_before=None):
+    work_start, work_end = working_hours or WORKING_HOURS
+    range_start = timegm(first_day.timetuple()) - WIB_OFFSET_SECONDS  # Tengah malam WIB
+    wib_zone = pytz.timezone('Asia/Jakarta')
+    events = calendar_manager.events_between(
+        datetime.fromtimestamp(range_start, wib_zone),
+        datetime.fromtimestamp(range_start + days * 86400, wib_zone),
+    )
+    # Acara seharian (ulang tahun, hari libur) biasanya hanya penanda, jadi tidak dihitung sibuk
+    busy = merge_busy_intervals(
+        event_timestamps(event) for event in events if isinstance(event['start'], datetime)
+    )
+
+    free = {}
+    position = 0
+    min_seconds = min_minutes * 60
+    for offset in range(days):
+        day_start = range_start + offset * 86400
+        cursor, window_end = day_start + work_start * 60, day_start + work_end * 60
+        if not_before is not None:
+            cursor = max(cursor, not_before)
+        # Interval sibuk sudah terurut dan tidak tumpang tindih, jadi cukup satu penunjuk untuk semua hari
+        while position < len(busy) and busy[position][1] <= cursor:
+            position += 1
+        slots = []
+        scan = position
+        while scan < len(busy) and busy[scan][0] < window_end:
+            if busy[scan][0] - cursor >= min_seconds:
+                slots.append((cursor, busy[scan][0]))
+            cursor = max(cursor, busy[scan][1])
+            scan += 1
+        if window_end - cursor >= min_seconds:
+            slots.append((cursor, window_end))
+        free[first_day + timedelta(days=offset)] = slots
+    return free
+
+# Function to format free slots as one compact line per day
+def format_availability(free_slots):
+    def wib_time(timestamp):
+        return time.strftime('%H:%M', time.gmtime(timestamp + WIB_OFFSET_SECONDS))
+
+    lines = []
+    for day, slots in free_slots.items():
+        times = ", ".join(f"{wib_time(start)}-{wib_time(end)}" for start, end in slots) or "no free time"
+        lines.append(f"{day.strftime('%a %Y-%m-%d')}: {times}")
+    return "\n".join(lines)
+
+# Function to summarize the free time for the days a prompt asks about (the coming days by default)
+def availability_summary(calendar_manager, prompt, now=None):
+    wib_zone = pytz.timezone('Asia/Jakarta')
+    now = now or datetime.now(wib_zone)
+    date_range = parse_date_range(prompt, now)
+    if date_range:
+        # Hari yang sudah lewat tidak punya waktu luang lagi
+        first_day = max(date_range[0].date(), now.date())
+        days = min((date_range[1].date() - first_day).days, DEFAULT_MAX_AVAILABILITY_DAYS)
+    else:
+        first_day, days = now.date(), DEFAULT_AVAILABILITY_DAYS
+    if days <= 0:
+        return ""
+    # Waktu luang dimulai dari kelipatan DEFAULT_MIN_FREE_MINUTES berikutnya (jam WIB), bukan dari menit sekarang,
+    # supaya ringkasan di konteks sistem tidak berubah setiap menit dan tetap kena cache
+    step = max(1, DEFAULT_MIN_FREE_MINUTES) * 60
+    not_before = -(-int(now.timestamp() + WIB_OFFSET_SECONDS) // step) * step - WIB_OFFSET_SECONDS
+    return format_availability(find_free_slots(calendar_manager, first_day, days, not_before=not_before))
+
+#---------------------availability-------------------------------+
+
+
+#---------------------intents-------------------------------+
+
+# Pertanyaan yang dijawab langsung dari kalender (Inggris dan Indonesia), dicek berurutan terhadap seluruh
+# kalimat setelah frasa tanggal dibuang; kalimat dengan isi lain tetap diteruskan ke model.
+# Pertanyaan ini sudah jelas tanpa tanggal: "berikutnya" menyebut rentangnya sendiri, jadwal tanpa tanggal berarti hari ini
+STANDALONE_INTENT_PATTERNS = [
+    ("next_event", r"((what'?s|what is|when is|show me|show) )?(my )?next (event|meeting|appointment|agenda)( on my (schedule|calendar|agenda))?"
+                   r"|what'?s next on my (schedule|calendar|agenda)"
+                   r"|((apa(kah)?|kapan) )?(acara|jadwal|agenda|rapat)(ku| saya| aku)? (berikutnya|selanjutnya)( (apa|kapan))?"),
+    ("schedule", r"(what'?s|what is|show me|show|list|check)( on)? my (schedule|agenda|calendar|events|meetings|appointments|plans)"
+                 r"|what are my (events|meetings|appointments|plans)"
+                 r"|((apa(kah)?|lihat|tampilkan|cek)( ada)? |ada )?(jadwal|agenda|acara|rapat)(ku| saya| aku)?( apa( saja| aja)?)?"),
+]
+# Pertanyaan yang hanya dijawab dari kalender bila menyebut tanggal
+INTENT_PATTERNS = [
+    ("free_time", r"(when|what time) am i (free|available)|(am i|will i be) (free|available)"
+                  r"|(what is|what'?s|show me|show|check) my (free time|availability|free slots)"
+                  r"|(when )?do i have (any )?(free time|free slots)|is there (any )?free time"
+                  r"|(kapan|jam berapa) (saya|aku) (kosong|luang|senggang|free)|apa(kah)? (saya|aku) (kosong|luang|senggang|free)"
+                  r"|(kapan|jam berapa|apa(kah)?|cek|lihat)( ada)? waktu (luang|kosong|senggang)( saya| aku|ku)?"
+                  r"|waktu (luang|kosong|senggang)( saya| aku|ku)? (kapan|jam berapa)"),
+    ("schedule", r"what do i have( on my (schedule|calendar|agenda))?|what'?s( on)?"
+                 r"|(do i have|are there|is there) (any )?(events?|meetings?|appointments?|plans)"),
+]
+# Frasa tanggal yang dikenali parse_date_range (beserta kata depannya), dibuang sebelum mencocokkan pertanyaan
+DATE_WORD_PATTERN = "|".join(
+    [pattern[3:-3] for pattern, _ in RELATIVE_DAYS]
+    + [r"this week|minggu ini|pekan ini|next week|minggu depan|pekan depan|this month|bulan ini"]
+    + sorted(WEEKDAY_NAMES, key=len, reverse=True)
+    + [r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4}",
+       rf"\d{{1,2}} (?:{'|'.join(sorted(MONTH_NAMES, key=len, reverse=True))})(?: \d{{4}})?"]
+)
+DATE_PHRASE_PATTERN = (
+    rf"\b(?:(?:on|for|in|at|pada|untuk|di|hari) )?(?:{DATE_WORD_PATTERN})"
+    rf"(?: (?:and|or|to|dan|atau|sampai|hingga) (?:(?:on|for|pada|hari) )?(?:{DATE_WORD_PATTERN}))*\b"
+)
+# Sapaan dan kata sopan yang tidak mengubah pertanyaan
+FILLER_WORDS = {"aria", "please", "tolong", "dong", "ya", "sih"}
+INDONESIAN_PATTERN = r"\b(saya|aku|jadwal\w*|acara\w*|apa|ada|hari|besok|lusa|kosong|luang|senggang|berikutnya|selanjutnya|minggu|bulan)\b"
+SUGGESTION_QUESTION = "Would you like me to suggest some improvements"
+YES_REPLIES = {"yes", "sure", "okay", "ok", "ya", "iya", "boleh"}
+NO_REPLIES = {"no", "not now", "tidak", "nggak", "gak", "nanti saja"}
+
+# Function to format an event as one line of a schedule answer
+def format_event_answer(event):
+    start, end = event_bounds(event)
+    if not isinstance(event['start'], datetime):
+        line = f"- {start.strftime('%a %Y-%m-%d')} (all day): {event['summary']}"
+    else:
+        line = f"- {start.strftime('%a %Y-%m-%d %H:%M')}-{end.strftime('%H:%M')}: {event['summary']}"
+    if event.get('location'):
+        line += f" ({event['location']})"
+    return line
+
+# Function to describe a date range as a single day or "first - last"
+def format_range_label(range_start, range_end):
+    last_day = (range_end - timedelta(seconds=1)).date()
+    if last_day == range_start.date():
+        return range_start.strftime('%a %Y-%m-%d')
+    return f"{range_start.strftime('%a %Y-%m-%d')} - {last_day.strftime('%a %Y-%m-%d')}"
+
+# Function to match a prompt against the intent questions, returns (intent, date_range) or None
+def match_intent(prompt, now):
+    question = re.sub(DATE_PHRASE_PATTERN, " ", prompt.lower().replace("\u2019", "'"))
+    question = " ".join(word for word in re.sub(r"[?!.,]", " ", question).split() if word not in FILLER_WORDS)
+    date_range = parse_date_range(prompt, now)
+    intent = next((name for name, pattern in STANDALONE_INTENT_PATTERNS if re.fullmatch(pattern, question)), None)
+    # Jadwal tanpa tanggal berarti hari ini; pertanyaan lain hanya dijawab bila menyebut tanggal
+    if intent == "schedule" and date_range is None:
+        day_start = pytz.timezone('Asia/Jakarta').localize(datetime.combine(now.date(), datetime.min.time()))
+        date_range = (day_start, day_start + timedelta(days=1))
+    if intent is None and date_range is not None:
+        intent = next((name for name, pattern in INTENT_PATTERNS if re.fullmatch(pattern, question)), None)
+    if intent is None:
+        return None
+    return intent, date_range
+
+# Function to answer simple schedule questions from the calendar, returns (intent, reply) or None to fall through to the model
+def route_intent(prompt, calendar_manager, last_reply="", now=None):
+    text = prompt.lower().strip()
+    indonesian = re.search(INDONESIAN_PATTERN, text) is not None
+    has_calendar = calendar_manager is not None and bool(calendar_manager.events)
+    wib_zone = pytz.timezone('Asia/Jakarta')
+    now = now or datetime.now(wib_zone)
+
+    # Jawaban ya/tidak atas tawaran perbaikan jadwal di balasan sebelumnya
+    if SUGGESTION_QUESTION in (last_reply or ""):
+        reply = text.strip(" .!")
+        if reply in YES_REPLIES:
+            recommendation = calendar_manager.analysis()[1] if has_calendar else "No recommendation available."
+            return "accept_suggestion", f"Here are the suggested improvements:\n{recommendation}"
+        if reply in NO_REPLIES:
+            return "decline_suggestion", "Got it! Let me know if you need help later."
+
+    matched = match_intent(prompt, now)
+    if matched is None:
+        return None
+    intent, date_range = matched
+    if not has_calendar:
+        if indonesian:
+            return intent, "Saya tidak menemukan data jadwal. Silakan unggah kalender Anda terlebih dahulu."
+        return intent, "I couldn't find any calendar data. Please upload your calendar first."
+
+    if intent == "next_event":
+        # Tanpa tanggal, acara berikutnya dicari dalam beberapa hari ke depan
+        window_end = date_range[1] if date_range else now + timedelta(days=DEFAULT_CONTEXT_LOOKAHEAD_DAYS)
+        upcoming = calendar_manager.events_between(max(now, date_range[0]) if date_range else now, window_end)
+        upcoming = [event for event in upcoming if event_bounds(event)[0] >= now]
+        if not upcoming and date_range:
+            label = format_range_label(*date_range)
+            return intent, f"Tidak ada acara berikutnya pada {label}." if indonesian else f"You have no upcoming events on {label}."
+        if not upcoming:
+            if indonesian:
+                return intent, f"Tidak ada acara dalam {DEFAULT_CONTEXT_LOOKAHEAD_DAYS} hari ke depan."
+            return intent, f"You have no events in the next {DEFAULT_CONTEXT_LOOKAHEAD_DAYS} days."
+        event = min(upcoming, key=lambda event: event_bounds(event)[0])
+        header = "Acara berikutnya:" if indonesian else "Your next event:"
+        return intent, f"{header}\n{format_event_answer(event)}"
+
+    if intent == "free_time":
+        availability = availability_summary(calendar_manager, prompt, now)
+        if not availability:
+            return intent, "Tanggal tersebut sudah lewat." if indonesian else "Those dates are already in the past."
+        if indonesian:
+            return intent, f"Waktu luang Anda dalam jam kerja ({DEFAULT_WORKING_HOURS} WIB):\n{availability}"
+        return intent, f"Your free time within working hours ({DEFAULT_WORKING_HOURS} WIB):\n{availability}"
+
+    # Daftar jadwal untuk rentang tanggal yang disebut (hari ini bila tidak ada tanggal)
+    label = format_range_label(*date_range)
+    events = sorted(calendar_manager.events_between(*date_range), key=lambda event: event_bounds(event)[0])
+    if not events:
+        return intent, f"Tidak ada acara pada {label}." if indonesian else f"You have no events on {label}."
+    lines = [format_event_answer(event) for event in events[:DEFAULT_INTENT_MAX_EVENTS]]
+    if len(events) > DEFAULT_INTENT_MAX_EVENTS:
+        extra = len(events) - DEFAULT_INTENT_MAX_EVENTS
+        lines.append(f"... dan {extra} acara lainnya" if indonesian else f"... and {extra} more")
+    header = f"Berikut jadwal Anda untuk {label} (WIB):" if indonesian else f"Here is your schedule for {label} (WIB):"
+    return intent, "\n".join([header] + lines)
+
+#---------------------intents-------------------------------+
+
 
 #---------------------anlyzing-------------------------------+
 
+# Jenis kegiatan hasil klasifikasi judul acara
+ACTIVITY_WORK, ACTIVITY_WORKOUT, ACTIVITY_REST = 0, 1, 2
+
+# Function to classify an event summary (checked once per distinct summary, not per event)
+def classify_activity(summary):
+    summary = summary.lower()
+    if 'work' in summary:
+        return ACTIVITY_WORK
+    elif 'workout' in summary:
+        return ACTIVITY_WORKOUT
+    return ACTIVITY_REST
+
 # Fungsi untuk menganalisis waktu yang dihabiskan pada jenis kegiatan
 def analyze_activity_schedule(calendar_data):
-    activities = []
-    work_time = 0
-    workout_time = 0
-    rest_time = 0
-
-    # Proses data kalender untuk menganalisis kegiatan
-    for event in calendar_data:
-        event_duration = (event['end'] - event['start']).total_seconds() / 3600  # dalam jam
-        if 'work' in event['summary'].lower():
-            work_time += event_duration
-        elif 'workout' in event['summary'].lower():
-            workout_time += event_duration
-        else:
-            rest_time += event_duration
-        activities.append({'Event': event['summary'], 'Duration (hours)': event_duration})
+    import numpy as np
+    import pandas as pd
+
+    columns = calendar_data if isinstance(calendar_data, EventColumns) else EventColumns(calendar_data)
+
+    # Proses data kalender untuk menganalisis kegiatan (vektor, dalam jam)
+    durations = columns.durations()
+    summary_kinds = np.fromiter((classify_activity(summary) for summary in columns.summaries), dtype=np.int64, count=len(columns.summaries))
+    event_kinds = summary_kinds[columns.summary_codes]
+    work_time, workout_time, rest_time = np.bincount(event_kinds, weights=durations, minlength=3)
 
     # Menyusun data ke dalam DataFrame
-    activity_df = pd.DataFrame(activities)
+    activity_df = pd.DataFrame({
+        'Event': pd.Categorical.from_codes(columns.summary_codes, categories=columns.summaries),
+        'Duration (hours)': durations,
+    })
     
     # Analisis: Jika waktu kerja lebih banyak daripada olahraga
     if work_time > workout_time:
@@ -280,25 +2775,53 @@ def analyze_activity_schedule(calendar_data):
 
     return activity_df, recommendation
 
-def plot_activity_analysis(activity_df):
-    activity_summary = activity_df.groupby('Event')['Duration (hours)'].sum().sort_values(ascending=False)
-    
-    plt.figure(figsize=(10,6))
-    activity_summary.plot(kind='bar', color=['#FF6347', '#4682B4', '#32CD32'])
-    plt.title('Activity Analysis')
-    plt.xlabel('Activity Type')
-    plt.ylabel('Total Duration (hours)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    st.pyplot(plt)
+# Function to total the hours per event, longest first
+def summarize_activity(activity_df):
+    return activity_df.groupby('Event', observed=True)['Duration (hours)'].sum().sort_values(ascending=False)
+
+# Function to render the activity bar chart as PNG bytes, cached on the hash of the aggregated series
+# (Figure dibuat tanpa pyplot, jadi tidak terdaftar di state global dan langsung dibebaskan)
+@st.cache_data(show_spinner=False, max_entries=64)
+def render_activity_chart(series_key, _activity_summary):
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 6))
+    try:
+        ax = figure.subplots()
+        ax.bar(_activity_summary.index.astype(str), _activity_summary.to_numpy(), color=['#FF6347', '#4682B4', '#32CD32'])
+        ax.set_title('Activity Analysis')
+        ax.set_xlabel('Activity Type')
+        ax.set_ylabel('Total Duration (hours)')
+        ax.tick_params(axis='x', labelrotation=45)
+        figure.tight_layout()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        figure.clear()
+
+def plot_activity_analysis(activity_df, native=DEFAULT_NATIVE_CHARTS):
+    activity_summary = summarize_activity(activity_df)
+
+    # Jalur cepat: grafik bawaan Streamlit, digambar di browser
+    if native:
+        st.bar_chart(activity_summary, x_label='Activity Type', y_label='Total Duration (hours)')
+        return
+
+    series_key = hashlib.sha256(
+        json.dumps([list(map(str, activity_summary.index)), activity_summary.round(6).tolist()]).encode("utf-8")
+    ).hexdigest()
+    st.image(render_activity_chart(series_key, activity_summary))
 
 def analyze_and_visualize_schedule():
     if "schedule" not in st.session_state or not st.session_state["schedule"]:
         st.write("No schedule data to analyze.")
         return
 
-    schedule_data = st.session_state["schedule"]
-    activity_df, recommendation = analyze_activity_schedule(schedule_data)
+    if "calendar_manager" in st.session_state:
+        activity_df, recommendation = st.session_state["calendar_manager"].analysis()
+    else:
+        activity_df, recommendation = analyze_activity_schedule(st.session_state["schedule"])
     st.session_state["recommendation"] = recommendation  # Simpan rekomendasi
 
     # # Tampilkan rekomendasi
@@ -314,29 +2837,86 @@ if "schedule" in st.session_state:
 #---------------------anlyzing-------------------------------+
 
 
+# InstanceMetadataService class: looks up the EC2 instance ID in a background thread and caches the result
+class InstanceMetadataService:
+    def __init__(self, base_url=INSTANCE_METADATA_URL, ttl=INSTANCE_METADATA_TTL, negative_ttl=INSTANCE_METADATA_NEGATIVE_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.value = None
+        self.expires_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    # Function to start a background lookup unless one is already running
+    def refresh(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._fetch, name="instance-metadata", daemon=True).start()
+
+    def _fetch(self):
+        value, ttl = "Instance ID not available (local or retrieval error)", self.negative_ttl
+        try:
+            token_response = requests.put(
+                f"{self.base_url}/latest/api/token",
+                headers={"X-aws-ec2-metadata-token-ttl-seconds": "21600"},
+                timeout=1
+            )
+            token_response.raise_for_status()
+
+            instance_response = requests.get(
+                f"{self.base_url}/latest/meta-data/instance-id",
+                headers={"X-aws-ec2-metadata-token": token_response.text},
+                timeout=1
+            )
+            instance_response.raise_for_status()
+            value, ttl = instance_response.text, self.ttl
+        except Exception as e:
+            # Hasil negatif juga disimpan agar tidak dicoba ulang di setiap rerun
+            if not isinstance(e, requests.exceptions.RequestException):
+                print(f"Error retrieving instance ID: {e}")
+        finally:
+            # Selalu dilepas, agar satu kegagalan tak terduga tidak menghentikan refresh berikutnya
+            with self.lock:
+                self.value = value
+                self.expires_at = time.time() + ttl
+                self.refreshing = False
+
+    # Function to get the cached instance ID without blocking; expired values are refreshed in the background
+    def instance_id(self):
+        if time.time() >= self.expires_at:
+            self.refresh()
+        return self.value or "Looking up instance ID..."
+
+# Shared metadata service for the whole process, started once at startup
+@st.cache_resource(show_spinner=False)
+def get_instance_metadata_service():
+    service = InstanceMetadataService()
+    service.refresh()
+    return service
+
 # Function to retrieve EC2 instance ID
 def get_instance_id():
-    try:
-        token = requests.put(
-            "http://169.254.169.254/latest/api/token",
-            headers={"X-aws-ec2-metadata-token-ttl-seconds": "21600"},
-            timeout=1
-        ).text
-
-        instance_id = requests.get(
-            "http://169.254.169.254/latest/meta-data/instance-id",
-            headers={"X-aws-ec2-metadata-token": token},
-            timeout=1
-        ).text
-        return instance_id
-    except requests.exceptions.RequestException:
-        return "Instance ID not available (local or retrieval error)"
-
-# Initialize ConversationManager object
+    return get_instance_metadata_service().instance_id()
+
+get_instance_metadata_service()
+warm_up_tokenizer()
+
+# Initialize ConversationManager object, resuming the session named in the URL (?session=<id>) if any
 if 'chat_manager' not in st.session_state:
-    st.session_state['chat_manager'] = ConversationManager()
+    st.session_state['chat_manager'] = ConversationManager(session_id=st.query_params.get("session"))
 
 chat_manager = st.session_state['chat_manager']
+chat_manager.quota_key = session_memory_key()  # Reset membuat session_id baru, jadi kuota mengikuti sesi browser
+
+# Function to keep the session ID in the URL so a reload, on this node or another, resumes the session
+def remember_session_id(session_id):
+    if (get_conversation_store() or get_session_backend()) and st.query_params.get("session") != session_id:
+        st.query_params["session"] = session_id
+
+remember_session_id(chat_manager.session_id)
 
 # User input for chat
 st.markdown("""
@@ -361,45 +2941,6 @@ user_input = st.chat_input("Write a message")
 
 
 
-# Get AI response based on user input
-if user_input:
-    response = chat_manager.chat_completion(user_input)
-
-    # Cek apakah respons sudah mencakup rekomendasi atau jadwal
-    if "Would you like me to suggest some improvements" in chat_manager.ai_response:
-        # Menyediakan rekomendasi jadwal jika diperlukan
-        recommendation = st.session_state.get("recommendation", "No recommendation available.")
-        if user_input.lower() in ["yes", "sure", "okay"]:
-            st.write("Here are the suggested improvements:")
-            st.write(recommendation)
-
-            # Menambahkan ke jadwal jika disetujui
-            new_event = {"summary": "Suggested Improvement", "start": datetime.now(), "end": datetime.now() + timedelta(hours=1)}
-            st.session_state["schedule"].append(new_event)
-
-            # Re-analyze schedule
-            analyze_and_visualize_schedule()
-
-        elif user_input.lower() in ["no", "not now"]:
-            st.write("Got it! Let me know if you need help later.")
-    
-    # Menangani permintaan untuk jadwal hanya sekali
-    elif "jadwal saya" in user_input.lower():
-        schedule = st.session_state.get("schedule", None)
-        if schedule:
-            # Formatkan jadwal untuk ditampilkan
-            formatted_schedule = "\n".join(
-                f"{convert_to_wib(event['start']).strftime('%H:%M')} - {convert_to_wib(event['end']).strftime('%H:%M')} : {event['summary']}" 
-                for event in schedule
-            )
-            # response = f"Berikut adalah jadwal Anda:\n{formatted_schedule}"
-        else:
-            response = "Saya tidak menemukan data jadwal. Silakan unggah kalender Anda terlebih dahulu."
-
-        # # Tambahkan ke riwayat percakapan hanya jika belum ada respons yang duplikat
-        # chat_manager.conversation_history.append({"role": "assistant", "content": response})
-        # st.chat_message("assistant").markdown(response)
-
 st.markdown("""
                 <style>
                 .stChatMessage {
@@ -408,30 +2949,88 @@ st.markdown("""
                 </style>
             """, unsafe_allow_html=True)
 
-# Display conversation history
-for message in chat_manager.conversation_history:
-    if message["role"] != "system":  # Ignore system messages
-        if message["role"] == "user":
-            with st.chat_message("user"):
-                st.markdown(
-                    f"""
-                    <div style="background-color: #dbc6a7; border-radius: 10px; padding: 10px;">
-                        <p style='color: black'>{message['content']}</p>
-                    </div>
-                    """, 
-                    unsafe_allow_html=True
-                )
-        elif message["role"] == "assistant":
-            with st.chat_message("assistant"):
-                st.markdown(
-                    f"""
-                    <div style="background-color:  #b19a70; border-radius: 10px; padding: 10px;">
-                        <p style='color: black'>{message['content']}</p>
+# Warna gelembung chat untuk masing-masing peran
+MESSAGE_COLORS = {"user": "#dbc6a7", "assistant": "#b19a70"}
+
+# Function to format a chat message as an HTML bubble (baris baru dipertahankan sebagai <br>)
+def format_message_html(role, content):
+    content = content.replace("\n", "<br>")
+    return f"""
+                    <div style="background-color: {MESSAGE_COLORS[role]}; border-radius: 10px; padding: 10px;">
+                        <p style='color: black'>{content}</p>
                     </div>
-                    """, 
-                    unsafe_allow_html=True
-                )
+                    """
+
+# Function to get the HTML bubble of a history message, formatted once and cached on the message
+def message_html(message):
+    if "html" not in message:
+        message["html"] = format_message_html(message["role"], message['content'])
+    return message["html"]
+
+# Display conversation history (hanya N pesan terakhir, sisanya lewat tombol "Load earlier messages")
+if "history_window" not in st.session_state:
+    st.session_state["history_window"] = DEFAULT_HISTORY_WINDOW
+
+# Function to widen the history window by one page
+def load_earlier_messages():
+    st.session_state["history_window"] += DEFAULT_HISTORY_WINDOW
+
+hidden_messages = chat_manager.conversation_history.turn_count() - st.session_state["history_window"]
+if hidden_messages > 0:
+    st.button(f"Load earlier messages ({hidden_messages} hidden)", on_click=load_earlier_messages)
 
+with run_timer.span("history_render"):
+    for message in chat_manager.conversation_history.recent(st.session_state["history_window"]):
+        if message["role"] in MESSAGE_COLORS:  # Ignore system messages
+            with st.chat_message(message["role"]):
+                st.markdown(message_html(message), unsafe_allow_html=True)
+
+
+# Get AI response based on user input
+if user_input:
+    with st.chat_message("user"):
+        st.markdown(format_message_html("user", user_input), unsafe_allow_html=True)
+
+    # Pertanyaan jadwal sederhana dijawab langsung dari kalender, tanpa memanggil model
+    calendar_manager = st.session_state.get("calendar_manager", None)
+    with run_timer.span("intent_router"):
+        routed = route_intent(user_input, calendar_manager, chat_manager.ai_response) if DEFAULT_INTENT_ROUTER else None
+
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        if routed:
+            response = routed[1]
+            chat_manager.record_local_answer(user_input, response)
+            placeholder.markdown(format_message_html("assistant", response), unsafe_allow_html=True)
+        elif chat_manager.stream:
+            # Tampilkan potongan balasan segera setelah diterima
+            response = ""
+            for delta in chat_manager.stream_chat_completion(user_input):
+                response += delta
+                placeholder.markdown(format_message_html("assistant", response), unsafe_allow_html=True)
+        else:
+            response = chat_manager.chat_completion(user_input)
+            if response:
+                placeholder.markdown(format_message_html("assistant", response), unsafe_allow_html=True)
+        if chat_manager.rejection:
+            placeholder.info(admission_message(chat_manager.rejection))
+        elif chat_manager.last_error:
+            placeholder.error("ARIA could not reach the language model right now. Please try again in a moment.")
+
+    # Menambahkan ke jadwal jika saran perbaikan disetujui
+    if routed and routed[0] == "accept_suggestion":
+        new_event = {"summary": "Suggested Improvement", "start": datetime.now(), "end": datetime.now() + timedelta(hours=1)}
+        if calendar_manager:
+            calendar_manager.add_event(new_event)
+        elif "schedule" in st.session_state:
+            st.session_state["schedule"].append(new_event)
+
+        # Re-analyze schedule
+        analyze_and_visualize_schedule()
+
+
+# Catat waktu rerun ini (dan gilirannya, jika ada) sebelum sidebar menampilkannya
+run_metrics = finish_run_metrics(run_timer, chat_manager.timings if user_input else None, chat_manager.session_id)
 
 # Sidebar options for chatbot settings
 with st.sidebar:
@@ -466,8 +3065,22 @@ with st.sidebar:
                 <div class="custom-title">Imported Calendar Events</div>
             """, unsafe_allow_html=True)
             
+            # Tampilkan hanya acara dalam rentang tanggal yang dipilih (diambil dari index)
+            events = st.session_state["calendar_data"]
+            calendar_manager = st.session_state.get("calendar_manager", None)
+            if calendar_manager:
+                today = datetime.now(pytz.timezone('Asia/Jakarta')).date()
+                date_range = st.date_input("Show events between", (today, today + timedelta(days=7)))
+                if len(date_range) == 2:
+                    wib_zone = pytz.timezone('Asia/Jakarta')
+                    range_start = wib_zone.localize(datetime.combine(date_range[0], datetime.min.time()))
+                    range_end = wib_zone.localize(datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time()))
+                    events = calendar_manager.events_between(range_start, range_end)
+                if not events:
+                    st.write("No events in this date range.")
+
             # Loop through the events and display them in the main area
-            for event in st.session_state["calendar_data"]:
+            for event in events:
                 start_time_wib = convert_to_wib(event['start'])
                 end_time_wib = convert_to_wib(event['end']) if event['end'] else None
                 # st.markdown("""
@@ -523,6 +3136,29 @@ with st.sidebar:
         set_temp = st.slider("Temperature", 0.0, 1.0, DEFAULT_TEMPERATURE, step=0.1)
         st.session_state['chat_manager'].temperature = set_temp
 
+        # Toggle untuk menampilkan balasan secara streaming
+        set_stream = st.toggle("Stream Responses", DEFAULT_STREAM)
+        st.session_state['chat_manager'].stream = set_stream
+
+        # Statistik cache respons
+        if DEFAULT_CACHE_ENABLED:
+            cache_stats = get_completion_cache().stats()
+            st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['size']} entries")
+
+        # Panel debug waktu per giliran
+        st.session_state["debug_panel"] = st.toggle("Show Timing Debug Panel", st.session_state.get("debug_panel", DEFAULT_DEBUG_PANEL))
+
+        # Perkiraan memori sesi ini dan seluruh worker
+        session_bytes = st.session_state.get("session_bytes", 0)
+        memory_stats = get_session_registry().stats()
+        st.metric("Session memory", f"{session_bytes / (1024 * 1024):.2f} MB")
+        st.caption(f"Worker: {memory_stats['sessions']} sessions, {memory_stats['bytes'] / (1024 * 1024):.1f} MB, {memory_stats['evictions']} evicted")
+        if memory_stats["kept"]:
+            st.warning(f"{memory_stats['kept']} idle conversation(s) are kept in memory because they could not be reloaded after a release. "
+                       "Set DEFAULT_CONVERSATION_DB or DEFAULT_SESSION_BACKEND so idle sessions can be released.")
+        admission_stats = get_admission_controller().stats()
+        st.caption(f"API: {admission_stats['in_flight']} running, {admission_stats['waiting']} waiting, {sum(admission_stats['rejected'].values())} turned away")
+
         # Tampilkan EC2 Instance ID
         instance_id = get_instance_id()
         st.sidebar.markdown(
@@ -555,7 +3191,23 @@ with st.sidebar:
         </style>
     """, unsafe_allow_html=True)
 
+    if st.session_state.get("debug_panel", DEFAULT_DEBUG_PANEL):
+        with st.expander("Debug: timings", expanded=True):
+            st.markdown("\n".join(
+                f"- {name}: {seconds * 1000:.1f} ms" for name, seconds in sorted(run_metrics["spans"].items(), key=lambda item: -item[1])
+            ))
+            if run_metrics.get("source"):
+                st.caption(f"Last turn answered by: {run_metrics['source']}")
+            if run_metrics.get("usage"):
+                st.caption(", ".join(f"{kind}: {count}" for kind, count in run_metrics["usage"].items()))
+
     if st.sidebar.button("Reset Conversation"):
         st.sidebar.write("Conversation reset!")
         chat_manager.reset_conversation_history()
-        st.rerun() 
\ No newline at end of file
+        st.session_state["history_window"] = DEFAULT_HISTORY_WINDOW
+        remember_session_id(chat_manager.session_id)
+        save_session_state()
+        st.rerun()
+
+save_session_state()
+track_session_memory() 
\ No newline at end of file